@@ -4,19 +4,26 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from crewai import Agent, llm
-from crewai.llm import LLM
-from tools import search_tool, BloodTestReportTool
+from llm_cache import CachedLLM
+from tools import get_search_tool, BloodTestReportTool
 
-# Set up the LLM
-llm = LLM(
-    model="gemini/gemini-2.0-flash-lite",api_key=os.environ.get("GOOGLE_API_KEY"),temperature=0.2)
+# Set up the LLM, sharing cached completions across agents and jobs.
+# The agents themselves are built per job (see task.create_section).
+# FAKE_LLM=true swaps in a deterministic offline stand-in for benchmarks and load tests.
+if os.environ.get("FAKE_LLM", "false").lower() == "true":
+    from fake_llm import FakeLLM
+    llm = FakeLLM()
+else:
+    llm = CachedLLM(
+        model="gemini/gemini-2.0-flash-lite",api_key=os.environ.get("GOOGLE_API_KEY"),temperature=0.2)
 
 # Creating a senior medical professional agent
-doctor = Agent(
-    role="Senior Medical Professional",
-    goal="""To provide a comprehensive and accurate analysis of a blood test report by executing efficient, targeted searches 
+def create_doctor() -> Agent:
+    return Agent(
+        role="Senior Medical Professional",
+        goal="""To provide a comprehensive and accurate analysis of a blood test report by executing efficient, targeted searches 
     and synthesizing the findings into clear, actionable advice.""",
-    backstory="""You are a highly experienced doctor renowned for your diagnostic precision. Your primary tool is the 
+        backstory="""You are a highly experienced doctor renowned for your diagnostic precision. Your primary tool is the 
 'Blood Test Report Searcher', which allows you to query a patient's report. To provide a thorough analysis, you must:
 
 1.  **Deconstruct the User's Query**: Identify the key biomarkers and health concerns mentioned by the user.
@@ -28,19 +35,20 @@ doctor = Agent(
     biomarker, extract its value, units, and reference range. Identify any values that are outside the normal range.
 4.  **Formulate a Clear Response**: Provide a clear, empathetic, and well-structured analysis of the findings. Explain what 
     the results mean in simple terms and offer actionable advice. Your final answer must be this synthesized analysis, not tool code.""",
-    tools=[BloodTestReportTool()],
-    llm=llm,
-    max_iter=3,
-    memory=True,
-    allow_delegation=False,
-    verbose=True,
-)
+        tools=[BloodTestReportTool()],
+        llm=llm,
+        max_iter=3,
+        memory=True,
+        allow_delegation=False,
+        verbose=True,
+    )
 
 # Creating a medical data verifier agent
-verifier = Agent(
-    role="Medical Data Verifier",
-    goal="To meticulously and efficiently verify if a given document is an authentic blood test report and output a single sentence confirming or denying its validity.",
-    backstory="""You are a Health Information Management specialist with a keen eye for detail and efficiency. Your sole responsibility 
+def create_verifier() -> Agent:
+    return Agent(
+        role="Medical Data Verifier",
+        goal="To meticulously and efficiently verify if a given document is an authentic blood test report and output a single sentence confirming or denying its validity.",
+        backstory="""You are a Health Information Management specialist with a keen eye for detail and efficiency. Your sole responsibility 
     is to validate a document's authenticity in a single, decisive step.
 
     Your validation process is as follows:
@@ -51,44 +59,46 @@ verifier = Agent(
         is considered valid.
 
     Your final output MUST be one of two sentences: 'The document appears to be a valid blood test report.' or 'The document does not appear to be a valid blood test report.' Do not add any other text.""",
-    tools=[BloodTestReportTool()],
-    llm=llm,
-    max_iter=3,
-    memory=True,
-    allow_delegation=False,
-    verbose=True,
-)
+        tools=[BloodTestReportTool()],
+        llm=llm,
+        max_iter=3,
+        memory=True,
+        allow_delegation=False,
+        verbose=True,
+    )
 
 # Creating a nutritionist agent
-nutritionist = Agent(
-    role="Certified Nutritionist",
-    goal="To create personalized dietary advice based on a patient's blood test report. You must first analyze the report to identify key health metrics, then research and formulate a targeted nutrition plan.",
-    backstory="""You are a certified nutritionist specializing in evidence-based dietary plans. Your process is methodical and patient-focused:
+def create_nutritionist() -> Agent:
+    return Agent(
+        role="Certified Nutritionist",
+        goal="To create personalized dietary advice based on a patient's blood test report. You must first analyze the report to identify key health metrics, then research and formulate a targeted nutrition plan.",
+        backstory="""You are a certified nutritionist specializing in evidence-based dietary plans. Your process is methodical and patient-focused:
 1.  **Analyze the Report**: Use the 'Blood Test Report Searcher' tool to find the values of key biomarkers (e.g., search for "glucose," "cholesterol," "hemoglobin").
 2.  **Identify Health Concerns**: Based on the search results, identify any biomarkers that are outside of the normal reference range.
 3.  **Research Targeted Advice**: For each identified concern, use the general search tool to find specific, actionable nutrition recommendations. For example, if cholesterol is high, you would search for "dietary advice for high cholesterol."
 4.  **Synthesize and Deliver**: Consolidate your research into a clear, easy-to-follow nutrition plan. Your final answer must be this plan, not tool code or raw search results.""",
-    tools=[BloodTestReportTool(), search_tool],
-    llm=llm,
-    max_iter=3,
-    memory=True,
-    allow_delegation=False,
-    verbose=True,
-)
+        tools=[BloodTestReportTool(), get_search_tool()],
+        llm=llm,
+        max_iter=3,
+        memory=True,
+        allow_delegation=False,
+        verbose=True,
+    )
 
 # Creating a fitness expert agent
-exercise_specialist = Agent(
-    role="Certified Exercise Physiologist",
-    goal="To develop safe and effective exercise plans based on a patient's blood test results. You must first analyze the report to understand the patient's physiological state, then research and create a suitable fitness regimen.",
-    backstory="""You are a certified exercise physiologist who designs fitness programs tailored to individual health profiles. Your methodology is as follows:
+def create_exercise_specialist() -> Agent:
+    return Agent(
+        role="Certified Exercise Physiologist",
+        goal="To develop safe and effective exercise plans based on a patient's blood test results. You must first analyze the report to understand the patient's physiological state, then research and create a suitable fitness regimen.",
+        backstory="""You are a certified exercise physiologist who designs fitness programs tailored to individual health profiles. Your methodology is as follows:
 1.  **Analyze the Report**: Use the 'Blood Test Report Searcher' tool to assess key physiological markers (e.g., search for "Complete Blood Count," "Lipid Profile").
 2.  **Identify Health Considerations**: From the report, identify any health metrics that might impact physical activity (e.g., signs of anemia, high blood pressure indicators).
 3.  **Research Safe Exercises**: For any identified health considerations, use the general search tool to find safe and effective exercise guidelines. For example, if the report suggests anemia, you would search for "safe exercises for anemic individuals."
 4.  **Create a Personalized Plan**: Synthesize your findings into a structured, safe, and effective exercise plan. Your final answer must be this plan, not tool code or raw search results.""",
-    tools=[BloodTestReportTool(), search_tool],
-    llm=llm,
-    max_iter=3,
-    memory=True,
-    allow_delegation=False,
-    verbose=True,
-)
+        tools=[BloodTestReportTool(), get_search_tool()],
+        llm=llm,
+        max_iter=3,
+        memory=True,
+        allow_delegation=False,
+        verbose=True,
+    )
@@ -1,4 +1,5 @@
 import chainlit as cl
+import json
 import os
 import asyncio
 import httpx
@@ -36,13 +37,17 @@ async def poll_for_result(task_id: str):
     async with httpx.AsyncClient() as client:
         while time.time() - start_time < timeout:
             try:
-                response = await client.get(f"{API_URL}/results/{task_id}", headers=headers)
+                # Poll the cheap status endpoint and only fetch the report once it is done
+                response = await client.get(f"{API_URL}/results/{task_id}/status", headers=headers)
                 response.raise_for_status()
-                data = response.json()
-                
-                if data["status"] == "COMPLETED":
-                    return data["result"]
-                elif data["status"] == "FAILED":
+                status = response.json()["status"]
+
+                if status in ("COMPLETED", "FAILED"):
+                    response = await client.get(f"{API_URL}/results/{task_id}", headers=headers)
+                    response.raise_for_status()
+                    data = response.json()
+                    if status == "COMPLETED":
+                        return data["result"]
                     return f"Analysis failed: {data.get('error', 'Unknown error')}"
                 
                 # Wait before polling again
@@ -55,6 +60,40 @@ async def poll_for_result(task_id: str):
         
         return "Analysis timed out. Please try again later."
 
+async def stream_results(task_id: str):
+    """Follows the backend's event stream, showing each agent's section as soon as it finishes."""
+    headers = {"accept": "text/event-stream"}
+    timeout = httpx.Timeout(10, read=60)  # the server sends a keep-alive at least every 15 seconds
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async with client.stream("GET", f"{API_URL}/results/{task_id}/stream", headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+
+                if event["status"] == "SECTION_COMPLETED":
+                    await cl.Message(content=f"## {event['title']}\n\n{event['content']}").send()
+                elif event["status"] == "COMPLETED":
+                    return event["result"]
+                elif event["status"] == "FAILED":
+                    return f"Analysis failed: {event.get('error', 'Unknown error')}"
+
+    return None
+
+async def wait_for_result(task_id: str):
+    """Waits for the analysis result over the event stream, falling back to polling."""
+    try:
+        result = await asyncio.wait_for(stream_results(task_id), timeout=300)
+        if result is not None:
+            return result
+    except asyncio.TimeoutError:
+        return "Analysis timed out. Please try again later."
+    except (httpx.HTTPError, ValueError):
+        pass
+    return await poll_for_result(task_id)
+
 
 @cl.on_chat_start
 async def start_chat():
@@ -92,8 +131,8 @@ async def start_chat():
     msg.content = f"Your report `{file.name}` is being analyzed. Task ID: `{task_id}`. Please wait."
     await msg.update()
 
-    # 2. Poll for the result
-    final_result = await poll_for_result(task_id)
+    # 2. Wait for the result, showing each agent's section as it arrives
+    final_result = await wait_for_result(task_id)
 
     # 3. Display the final result
     await cl.Message(content="--- Final Report ---").send()
@@ -0,0 +1,416 @@
+"""
+Offline benchmarks and load tests for the report pipeline.
+
+Every run writes a JSON file (to outputs/benchmarks/ unless --output is given)
+holding the commit, the configuration and per-benchmark timings, so two runs
+can be diffed with `compare`:
+
+    python benchmark.py micro
+    python benchmark.py e2e --jobs 8 --concurrency 4 --latency 0.5
+    python benchmark.py load --url http://localhost:8000 --clients 10 --requests 2
+    python benchmark.py compare outputs/benchmarks/micro-old.json outputs/benchmarks/micro-new.json
+
+`micro` and `e2e` need no network: e2e runs the crew against the FakeLLM
+stand-in, and the embedding model is read from the local HuggingFace cache
+(set HF_HUB_OFFLINE=1 once it has been downloaded). `load` targets a running
+API and worker; start the worker with FAKE_LLM=true to keep it offline too.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+DEFAULT_FILES = [os.path.join("data", "sample.pdf"), os.path.join("data", "blood_test_report.pdf")]
+DEFAULT_QUERY = "Summarise my Blood Test Report"
+RETRIEVAL_QUERIES = ["Hemoglobin", "LDL Cholesterol", "Thyroid Profile", "Vitamin D", "kidney function"]
+OUTPUT_DIR = os.path.join("outputs", "benchmarks")
+
+
+## Results
+def summarise(samples: list) -> dict:
+    """Timing statistics, in seconds, for a list of samples."""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "min_seconds": ordered[0],
+        "median_seconds": statistics.median(ordered),
+        "p95_seconds": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "mean_seconds": statistics.mean(ordered),
+        "max_seconds": ordered[-1],
+    }
+
+
+def time_calls(fn, repeat: int) -> dict:
+    """Calls fn `repeat` times and summarises the wall-clock time of each call."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarise(samples)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(suite: str, config: dict, results: dict, output: str = None) -> str:
+    """Writes one run's results as JSON and returns the path."""
+    commit = git_commit()
+    created_at = datetime.now(timezone.utc)
+    if output is None:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        output = os.path.join(OUTPUT_DIR, f"{suite}-{commit}-{created_at:%Y%m%dT%H%M%SZ}.json")
+    payload = {
+        "suite": suite,
+        "commit": commit,
+        "created_at": created_at.isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+    return output
+
+
+def print_results(results: dict):
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<50} ERROR {result['error']}")
+        elif "median_seconds" in result:
+            print(f"{name:<50} median {result['median_seconds'] * 1000:9.1f} ms   p95 {result['p95_seconds'] * 1000:9.1f} ms   n={result['count']}")
+        else:
+            print(f"{name:<50} {json.dumps(result, sort_keys=True)}")
+
+
+def use_scratch_storage(directory: str):
+    """Points every on-disk cache and the database at a scratch directory, so runs start cold
+    and never touch data/. Must run before the project modules are imported."""
+    os.environ["EXTRACTION_CACHE_DIR"] = os.path.join(directory, "extraction_cache")
+    os.environ["VECTOR_INDEX_DIR"] = os.path.join(directory, "vector_index")
+    os.environ["LLM_CACHE_DIR"] = os.path.join(directory, "llm_cache")
+    os.environ["SECTION_CACHE_DIR"] = os.path.join(directory, "section_cache")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+
+
+## Micro-benchmarks
+def run_micro(args) -> dict:
+    """Times each pipeline stage in isolation on the sample reports."""
+    from extraction import extract_report_tables, normalise_cells, read_tables, read_text_layer, read_report_tables
+    from lab_results import LabResultIndex, parse_lab_results, split_query_terms
+    from tools import BloodTestReportTool, build_report_text, load_report_tables
+
+    results = {}
+
+    def bench(name, fn, repeat=args.repeat):
+        try:
+            results[name] = time_calls(fn, repeat)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    for path in args.files:
+        report = os.path.basename(path)
+
+        # 1. Extraction, per tier and end to end
+        bench(f"{report}/extraction.text_layer", lambda: read_text_layer(path))
+        page_count = len(read_text_layer(path))
+        bench(f"{report}/extraction.camelot", lambda: read_tables(path, list(range(1, page_count + 1))), repeat=args.camelot_repeat)
+        bench(f"{report}/extraction.tiered", lambda: extract_report_tables(path))
+
+        # 2. Cleaning and lab result parsing of the raw tables
+        tables, _ = read_report_tables(path)
+        bench(f"{report}/cleaning.normalise_cells", lambda: [normalise_cells(df) for _, df in tables])
+        cleaned = [(page, normalise_cells(df).unstack(fill_value="")) for page, df in tables]
+        bench(f"{report}/cleaning.parse_lab_results", lambda: [parse_lab_results(df, page) for page, df in cleaned if not df.empty])
+
+        doc_hash, extraction = load_report_tables(path)
+        full_text = build_report_text(extraction)
+
+        # 3. Direct biomarker lookups
+        terms = split_query_terms(" OR ".join(RETRIEVAL_QUERIES))
+        lab_index = LabResultIndex(extraction["lab_results"])
+        bench(f"{report}/retrieval.lab_index", lambda: [lab_index.lookup(term) for term in terms])
+
+        if args.skip_embeddings:
+            continue
+
+        # 4. Chunking, embedding and vector retrieval
+        from embeddings import get_embeddings
+        from vector_index import get_report_index, split_report_text
+
+        bench(f"{report}/chunking.split_report_text", lambda: split_report_text(full_text))
+        chunks = [doc.page_content for doc in split_report_text(full_text)]
+        if "embedding.warm_up" not in results:
+            bench("embedding.warm_up", lambda: get_embeddings().embed_query("warm up"), repeat=1)
+        bench(f"{report}/embedding.embed_documents", lambda: get_embeddings().embed_documents(chunks))
+        bench(f"{report}/embedding.embed_query", lambda: [get_embeddings().embed_query(q) for q in RETRIEVAL_QUERIES])
+        bench(f"{report}/index.build", lambda: get_report_index(doc_hash, full_text), repeat=1)
+        vectorstore = get_report_index(doc_hash, full_text)
+        bench(f"{report}/retrieval.vector", lambda: [vectorstore.similarity_search(q, k=4) for q in RETRIEVAL_QUERIES])
+
+        # 5. The agents' tool call, warm
+        tool = BloodTestReportTool()
+        bench(f"{report}/tool.search", lambda: [tool._run(path, q) for q in RETRIEVAL_QUERIES])
+
+    return results
+
+
+## End-to-end crew jobs against the offline LLM
+def _init_e2e_worker():
+    """Loads the worker in a benchmark process, the way a Celery prefork child would."""
+    from celery_config import celery_app
+    import worker  # noqa: F401 - registers the tasks
+
+    celery_app.finalize(auto=True)
+
+
+def _run_e2e_job(request_id: str) -> dict:
+    """Runs one job's ingestion and crew in this process, like a worker serving both queues."""
+    from worker import run_analysis_crew, run_report_ingestion
+
+    start = time.perf_counter()
+    run_report_ingestion.apply(args=(request_id,))
+    ingested = time.perf_counter()
+    outcome = run_analysis_crew.apply(args=(request_id,))
+    finished = time.perf_counter()
+    return {
+        "ingestion": ingested - start,
+        "crew": finished - ingested,
+        "total": finished - start,
+        "ok": outcome.successful(),
+    }
+
+
+def run_e2e(args) -> dict:
+    """Runs ingestion followed by run_analysis_crew for each job, in `concurrency` worker processes.
+
+    Each process runs one job at a time, like a prefork worker child, so jobs
+    never share a process's agents, caches or rate limiter state the way they
+    would not in production either.
+    """
+    os.environ["FAKE_LLM"] = "true"
+    os.environ["FAKE_LLM_LATENCY_SECONDS"] = str(args.latency)
+    # crewai's telemetry is the only other network traffic in a crew run
+    os.environ.setdefault("CREWAI_DISABLE_TELEMETRY", "true")
+    os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+    from database import SessionLocal, AnalysisRequest, create_db_and_tables
+
+    create_db_and_tables()
+    db = SessionLocal()
+    try:
+        request_ids = []
+        for i in range(args.jobs):
+            path = args.files[i % len(args.files)]
+            request = AnalysisRequest(id=str(uuid.uuid4()), query=f"{args.query} [benchmark {i}]", file_path=path)
+            db.add(request)
+            request_ids.append(request.id)
+        db.commit()
+    finally:
+        db.close()
+
+    # spawn starts each process from the environment set above, with nothing imported yet
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.concurrency,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_e2e_worker,
+    ) as pool:
+        jobs = list(pool.map(_run_e2e_job, request_ids))
+    elapsed = time.perf_counter() - start
+
+    completed = [job for job in jobs if job["ok"]]
+    results = {
+        "e2e.summary": {
+            "jobs": len(jobs),
+            "failed": len(jobs) - len(completed),
+            "elapsed_seconds": elapsed,
+            "throughput_per_minute": 60 * len(completed) / elapsed if elapsed else 0.0,
+        },
+    }
+    if completed:
+        for stage in ("ingestion", "crew", "total"):
+            results[f"e2e.{stage}"] = summarise([job[stage] for job in completed])
+    return results
+
+
+## HTTP load generator
+async def _load_client(client, args, client_id: int, run_id: str, records: list):
+    for i in range(args.requests):
+        # A distinct query per request, unless reuse is what is being measured
+        query = args.query if args.reuse else f"{args.query} [load {run_id} {client_id}-{i}]"
+        record = {"ok": False}
+        start = time.perf_counter()
+        try:
+            with open(args.file, "rb") as f:
+                response = await client.post(
+                    "/analyze",
+                    files={"file": (os.path.basename(args.file), f, "application/pdf")},
+                    data={"query": query},
+                )
+            record["submit"] = time.perf_counter() - start
+            response.raise_for_status()
+            task_id = response.json()["task_id"]
+
+            poll_samples = []
+            status = None
+            deadline = start + args.timeout
+            while time.perf_counter() < deadline:
+                poll_start = time.perf_counter()
+                poll = await client.get(f"/results/{task_id}/status")
+                poll_samples.append(time.perf_counter() - poll_start)
+                status = poll.json().get("status")
+                if status in ("COMPLETED", "FAILED"):
+                    break
+                await asyncio.sleep(args.poll_interval)
+
+            fetch_start = time.perf_counter()
+            (await client.get(f"/results/{task_id}")).raise_for_status()
+            record["fetch"] = time.perf_counter() - fetch_start
+            record["polls"] = poll_samples
+            record["total"] = time.perf_counter() - start
+            record["status"] = status
+            record["ok"] = status == "COMPLETED"
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        records.append(record)
+
+
+async def _run_load(args) -> list:
+    import httpx
+
+    records = []
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60.0, limits=limits) as client:
+        await asyncio.gather(*(_load_client(client, args, n, run_id, records) for n in range(args.clients)))
+    return records
+
+
+def run_load(args) -> dict:
+    """Drives /analyze and /results from N concurrent clients against a running API and worker."""
+    start = time.perf_counter()
+    records = asyncio.run(_run_load(args))
+    elapsed = time.perf_counter() - start
+
+    completed = [r for r in records if r["ok"]]
+    errors = sorted({r["error"] for r in records if "error" in r})
+    results = {
+        "load.summary": {
+            "requests": len(records),
+            "completed": len(completed),
+            "failed": len(records) - len(completed),
+            "errors": errors[:10],
+            "elapsed_seconds": elapsed,
+            "throughput_per_minute": 60 * len(completed) / elapsed if elapsed else 0.0,
+        },
+    }
+    submitted = [r for r in records if "submit" in r]
+    if submitted:
+        results["load.submit"] = summarise([r["submit"] for r in submitted])
+    polls = [sample for r in records for sample in r.get("polls", [])]
+    if polls:
+        results["load.status_poll"] = summarise(polls)
+    if completed:
+        results["load.fetch_result"] = summarise([r["fetch"] for r in completed])
+        results["load.end_to_end"] = summarise([r["total"] for r in completed])
+    return results
+
+
+## Comparing two runs
+def compare(old_path: str, new_path: str, threshold: float) -> list:
+    """Lists the benchmarks that got slower (or lower throughput) by more than `threshold`."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)["results"]
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    regressions = []
+    for name in sorted(set(old) & set(new)):
+        for metric, higher_is_better in (("median_seconds", False), ("throughput_per_minute", True)):
+            before, after = old[name].get(metric), new[name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            print(f"{name:<50} {metric:<22} {before:10.4f} -> {after:10.4f} ({change:+.1%})")
+            if worse > threshold:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+
+    micro = subparsers.add_parser("micro", help="time extraction, cleaning, chunking, embedding and retrieval")
+    micro.add_argument("--files", nargs="+", default=DEFAULT_FILES)
+    micro.add_argument("--repeat", type=int, default=5)
+    micro.add_argument("--camelot-repeat", type=int, default=1, help="Camelot is slow, so it runs fewer times")
+    micro.add_argument("--skip-embeddings", action="store_true", help="skip the stages that need the embedding model")
+    micro.add_argument("--output")
+
+    e2e = subparsers.add_parser("e2e", help="run full crew jobs in worker processes against the offline LLM")
+    e2e.add_argument("--files", nargs="+", default=DEFAULT_FILES)
+    e2e.add_argument("--jobs", type=int, default=4)
+    e2e.add_argument("--concurrency", type=int, default=2)
+    e2e.add_argument("--latency", type=float, default=0.5, help="simulated seconds per LLM call")
+    e2e.add_argument("--query", default=DEFAULT_QUERY)
+    e2e.add_argument("--output")
+
+    load = subparsers.add_parser("load", help="drive a running API with concurrent HTTP clients")
+    load.add_argument("--url", default="http://localhost:8000")
+    load.add_argument("--file", default=DEFAULT_FILES[0])
+    load.add_argument("--clients", type=int, default=10)
+    load.add_argument("--requests", type=int, default=1, help="requests per client, sent one after another")
+    load.add_argument("--query", default=DEFAULT_QUERY)
+    load.add_argument("--reuse", action="store_true", help="send the same query every time to measure result reuse")
+    load.add_argument("--poll-interval", type=float, default=1.0)
+    load.add_argument("--timeout", type=float, default=900.0, help="seconds to wait for each analysis")
+    load.add_argument("--output")
+
+    diff = subparsers.add_parser("compare", help="compare two result files and flag regressions")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that counts as a regression")
+
+    args = parser.parse_args()
+
+    if args.suite == "compare":
+        regressions = compare(args.old, args.new, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("suite", "output")}
+    if args.suite == "load":
+        results = run_load(args)
+    else:
+        with tempfile.TemporaryDirectory() as scratch:
+            use_scratch_storage(scratch)
+            results = run_micro(args) if args.suite == "micro" else run_e2e(args)
+
+    print_results(results)
+    write_results(args.suite, config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+## Small caching helpers shared by the tools and the worker
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the hex SHA-256 digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalise_query(query: str) -> str:
+    """Lower-cases a query and collapses whitespace and trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().rstrip(".?!").lower()
+
+
+class LRUCache:
+    """A thread-safe in-process LRU cache with hit/miss counters and an optional TTL."""
+
+    def __init__(self, max_entries: int = 32, ttl_seconds: float = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class JSONDiskStore:
+    """Stores one JSON document per key in a directory.
+
+    File modification times double as last-access times: reads touch the file,
+    entries older than ttl_seconds are treated as missing, and once there are
+    more than max_entries files the least recently used ones are deleted.
+    """
+
+    # Pruning lists the whole directory, so only do it every few writes
+    PRUNE_EVERY = 50
+
+    def __init__(self, directory: str, ttl_seconds: float = None, max_entries: int = None):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._writes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            if self.ttl_seconds is not None and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                self.delete(key)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # A missing or half-written file is treated as a miss
+            return None
+        if self.ttl_seconds is not None or self.max_entries is not None:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return value
+
+    def set(self, key: str, value):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial document
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Deletes expired entries and, past max_entries, the least recently used ones."""
+        if self.ttl_seconds is None and self.max_entries is None:
+            return
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+
+        now = time.time()
+        stale = [path for mtime, path in entries if self.ttl_seconds is not None and now - mtime > self.ttl_seconds]
+        remaining = len(entries) - len(stale)
+        if self.max_entries is not None and remaining > self.max_entries:
+            stale += [path for _, path in entries[len(stale):len(stale) + remaining - self.max_entries]]
+
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class TieredCache:
+    """An in-process LRU layer in front of an on-disk JSON layer."""
+
+    def __init__(self, directory: str, max_entries: int = 32, ttl_seconds: float = None, max_disk_entries: int = None):
+        self.memory = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.disk = JSONDiskStore(directory, ttl_seconds=ttl_seconds, max_entries=max_disk_entries)
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        value = self.disk.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters for both layers."""
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+        }
@@ -1,13 +1,70 @@
+import os
 from celery import Celery
+from kombu import Queue
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# CPU-bound PDF ingestion and I/O-bound LLM work run on separate queues so they
+# can be served by differently sized worker pools.
+INGESTION_QUEUE = os.environ.get("INGESTION_QUEUE", "ingestion")
+LLM_QUEUE = os.environ.get("LLM_QUEUE", "llm")
+
+# Task names, so processes that only dispatch work (the API) never import worker.py
+INGESTION_TASK = "worker.run_report_ingestion"
+ANALYSIS_TASK = "worker.run_analysis_crew"
+
+# Selects one of the tuning profiles below
+CELERY_PROFILE = os.environ.get("CELERY_PROFILE", "development")
+
+# Settings shared by every profile
+BASE_CONFIG = dict(
+    task_track_started=True,
+    task_queues=(Queue(INGESTION_QUEUE), Queue(LLM_QUEUE)),
+    task_default_queue=LLM_QUEUE,
+    task_routes={
+        INGESTION_TASK: {"queue": INGESTION_QUEUE},
+        ANALYSIS_TASK: {"queue": LLM_QUEUE},
+    },
+)
+
+CELERY_PROFILES = {
+    # Local runs: Celery's defaults, with loose time limits so slow machines still finish
+    "development": dict(
+        task_annotations={
+            INGESTION_TASK: {"soft_time_limit": 600, "time_limit": 660},
+            ANALYSIS_TASK: {"soft_time_limit": 3600, "time_limit": 3660},
+        },
+    ),
+    # Long crew jobs: fetch one task at a time and only acknowledge it once it
+    # has finished, so a busy worker never sits on queued jobs and a crashed one
+    # hands its job back. Children are recycled to cap torch/Chroma memory growth.
+    "production": dict(
+        worker_prefetch_multiplier=1,
+        task_acks_late=True,
+        task_reject_on_worker_lost=True,
+        worker_max_tasks_per_child=int(os.environ.get("CELERY_MAX_TASKS_PER_CHILD", "50")),
+        # In kilobytes; a child exceeding this is replaced after its current task
+        worker_max_memory_per_child=int(os.environ.get("CELERY_MAX_MEMORY_PER_CHILD_KB", str(1536 * 1024))),
+        task_annotations={
+            INGESTION_TASK: {"soft_time_limit": 120, "time_limit": 180},
+            ANALYSIS_TASK: {"soft_time_limit": 900, "time_limit": 960},
+        },
+    ),
+}
+
+def hard_time_limit(task_name: str) -> int:
+    """The active profile's hard time limit for a task, in seconds."""
+    return CELERY_PROFILES[CELERY_PROFILE]["task_annotations"][task_name]["time_limit"]
 
 # Configure Celery
 celery_app = Celery(
     "tasks",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0",
+    broker=REDIS_URL,
+    backend=REDIS_URL,
     include=["worker"]  # Point to the file where tasks are defined
 )
 
 celery_app.conf.update(
-    task_track_started=True,
-) 
\ No newline at end of file
+    **BASE_CONFIG,
+    **CELERY_PROFILES[CELERY_PROFILE],
+)
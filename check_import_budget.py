@@ -0,0 +1,65 @@
+"""
+Checks that the FastAPI app stays cheap to import.
+
+The API only stores uploads and dispatches Celery tasks by name, so importing
+`main` must not pull in the worker's crew, model or PDF dependencies. Run it
+before shipping changes to main.py or the modules it imports:
+
+    python check_import_budget.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Wall-clock seconds allowed for `import main` in a fresh interpreter
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "3.0"))
+
+# Modules that only the Celery worker needs; none may be loaded by the API
+FORBIDDEN_MODULES = [
+    "worker", "agents", "task", "tools", "extraction", "vector_index", "npy_index", "embeddings",
+    "crewai", "crewai_tools", "litellm", "camelot", "cv2", "pymupdf", "chromadb",
+    "langchain", "langchain_community", "sentence_transformers", "torch",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_import() -> dict:
+    """Imports main in a fresh interpreter, against a throwaway database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'budget.db')}")
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_import_budget() -> list:
+    """Returns a list of problems; empty when the API import is within budget."""
+    result = measure_import()
+    loaded = set(result["modules"])
+    problems = [f"main imports worker-only module '{name}'" for name in FORBIDDEN_MODULES if name in loaded]
+    if result["seconds"] > IMPORT_BUDGET_SECONDS:
+        problems.append(f"import main took {result['seconds']:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+    print(f"import main: {result['seconds']:.2f}s, {len(loaded)} modules loaded")
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_import_budget()
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,93 @@
+## Token-budgeted assembly of the report context returned to the agents
+import os
+import re
+from typing import List
+
+# Upper bound on the tokens a single Blood Test Report Searcher call may return
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, about four characters per token."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def compact_table_text(text: str) -> str:
+    """Collapses df.to_string() column padding into 'cell | cell' rows."""
+    lines = []
+    for line in text.replace("\\n", " ").splitlines():
+        cells = [cell for cell in re.split(r"\s{2,}", line.strip()) if cell]
+        if cells:
+            lines.append(" | ".join(cells))
+        elif lines and lines[-1]:
+            # Keep a single blank line between tables
+            lines.append("")
+    return "\n".join(lines).strip()
+
+
+def merge_overlapping_chunks(chunks: List[str], full_text: str) -> List[str]:
+    """Merges chunks whose spans overlap or touch in the full text into single passages.
+
+    Merged passages keep the position of their most relevant member; chunks
+    that cannot be located in the full text are kept as they are.
+    """
+    spans = []
+    unplaced = []
+    for rank, chunk in enumerate(chunks):
+        start = full_text.find(chunk) if full_text else -1
+        if start < 0:
+            unplaced.append((rank, chunk))
+        else:
+            spans.append([start, start + len(chunk), rank])
+
+    spans.sort()
+    merged = []
+    for start, end, rank in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+            merged[-1][2] = min(merged[-1][2], rank)
+        else:
+            merged.append([start, end, rank])
+
+    passages = [(rank, full_text[start:end]) for start, end, rank in merged] + unplaced
+    passages.sort(key=lambda passage: passage[0])
+
+    unique = []
+    for _, passage in passages:
+        if passage not in unique:
+            unique.append(passage)
+    return unique
+
+
+def _truncate_to_budget(text: str, token_budget: int) -> str:
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line + "\n")
+        if used + cost > token_budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def build_context(parts: List[str], full_text: str = "", token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Merges, compacts and trims the parts (most relevant first) to fit the token budget."""
+    passages = [compact_table_text(passage) for passage in merge_overlapping_chunks(parts, full_text)]
+
+    selected = []
+    remaining = token_budget
+    for passage in passages:
+        if not passage:
+            continue
+        cost = estimate_tokens(passage)
+        if cost > remaining:
+            passage = _truncate_to_budget(passage, remaining)
+            if passage:
+                selected.append(passage)
+            break
+        selected.append(passage)
+        remaining -= cost
+
+    return "\n\n".join(selected)
+
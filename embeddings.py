@@ -0,0 +1,56 @@
+## Process-wide embedding model shared by every BloodTestReportTool instance
+import os
+import threading
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from instrumentation import span
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+
+
+class SharedEmbeddings(Embeddings):
+    """Wraps a single loaded HuggingFace model and serialises access to it.
+
+    The agents may run their tools from different threads, and the torch model
+    is not safe to call concurrently, so every encode goes through one lock.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self._model = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"batch_size": batch_size},
+        )
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            return self._model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            return self._model.embed_query(text)
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> SharedEmbeddings:
+    """Returns the embedding model for this process, loading it on first use."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                with span("embedding.load", model=EMBEDDING_MODEL):
+                    _embeddings = SharedEmbeddings()
+    return _embeddings
+
+
+def warm_up():
+    """Loads the model and runs one encode so the first real search is not slowed down."""
+    get_embeddings().embed_query("warm up")
@@ -0,0 +1,366 @@
+## Table extraction from PDF blood reports
+import multiprocessing
+import os
+import pickle
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import camelot
+import pandas as pd
+import pymupdf
+
+from lab_results import deduplicate_lab_results, parse_lab_results
+
+# Camelot parses pages on a single core, so long runs of pages are split into page
+# ranges that run in parallel worker processes.
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Fewer Camelot pages than this are parsed serially; the hand-off costs more than it saves
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.environ.get("PARALLEL_EXTRACTION_MIN_PAGES", "4"))
+
+# Pages whose text-layer row structure scores below this are re-read with Camelot
+TEXT_LAYER_MIN_CONFIDENCE = float(os.environ.get("TEXT_LAYER_MIN_CONFIDENCE", "0.8"))
+# A page needs at least this many multi-column rows before its text layer is trusted
+TEXT_LAYER_MIN_ROWS = 3
+
+END_OF_REPORT_MARKER = "End of report"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+## Fast path: rebuild table rows from the PDF's text layer
+def _group_rows(words: list, tolerance: float) -> list:
+    """Groups (x0, y0, x1, y1, text) words into lines by vertical centre, top to bottom."""
+    rows = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        centre = (word[1] + word[3]) / 2
+        if rows and centre - rows[-1]["centre"] <= tolerance:
+            rows[-1]["words"].append(word)
+        else:
+            rows.append({"centre": centre, "words": [word]})
+    return [sorted(row["words"], key=lambda w: w[0]) for row in rows]
+
+
+def _split_cells(row: list, gap: float) -> list:
+    """Splits a line into [x0, x1, text] cells wherever the space between words exceeds `gap`."""
+    cells = []
+    for x0, _, x1, _, text in row:
+        if cells and x0 - cells[-1][1] <= gap:
+            cells[-1][1] = x1
+            cells[-1][2] += " " + text
+        else:
+            cells.append([x0, x1, text])
+    return cells
+
+
+def _column_anchors(multi_cell_rows: list, tolerance: float) -> list:
+    """Left edges shared by the cells of enough multi-cell rows, left to right.
+
+    Edges used by only a handful of rows, such as the patient details block
+    in the page header, are not treated as columns of the results table.
+    """
+    clusters = []
+    for x0 in sorted(cell[0] for cells in multi_cell_rows for cell in cells):
+        if clusters and x0 - clusters[-1][-1] <= tolerance:
+            clusters[-1].append(x0)
+        else:
+            clusters.append([x0])
+    min_support = max(2, 0.2 * len(multi_cell_rows))
+    return [statistics.mean(cluster) for cluster in clusters if len(cluster) >= min_support]
+
+
+def _column_of(x0: float, anchors: list, tolerance: float) -> int:
+    column = 0
+    for i, anchor in enumerate(anchors):
+        if anchor <= x0 + tolerance:
+            column = i
+    return column
+
+
+def _split_blocks(rows: list, gap: float) -> list:
+    """Splits the page's lines into blocks wherever the vertical whitespace between them exceeds `gap`."""
+    blocks = []
+    bottom = None
+    for row in rows:
+        top = min(w[1] for w in row)
+        if not blocks or top - bottom > gap:
+            blocks.append([])
+        blocks[-1].append(row)
+        bottom = max(w[3] for w in row)
+    return blocks
+
+
+def _block_table(rows: list, tolerance: float) -> tuple:
+    """Lays one block's rows of cells out on its column edges, returning (DataFrame, clean rows, multi-cell rows)."""
+    multi_cell_rows = [cells for cells in rows if len(cells) > 1]
+    anchors = _column_anchors(multi_cell_rows, tolerance) if len(multi_cell_rows) > 1 else []
+    if len(anchors) < 2:
+        # Free text such as titles and footers: one line per row
+        return pd.DataFrame([["  ".join(cell[2] for cell in cells)] for cells in rows]), 0, 0
+
+    table = []
+    clean_rows = 0
+    for cells in rows:
+        record = [""] * len(anchors)
+        clean = True
+        for x0, _, text in cells:
+            i = _column_of(x0, anchors, tolerance)
+            clean = clean and not record[i] and abs(x0 - anchors[i]) <= tolerance
+            # Cells sharing a column are kept one per line, like Camelot's wrapped cells
+            record[i] = f"{record[i]}\n{text}" if record[i] else text
+        if len(cells) > 1 and clean:
+            clean_rows += 1
+        table.append(record)
+    return pd.DataFrame(table), clean_rows, len(multi_cell_rows)
+
+
+def rebuild_page_tables(words: list) -> tuple:
+    """Rebuilds one page's words into tables, returning (list of DataFrames, row structure confidence).
+
+    Confidence is the share of multi-cell rows whose cells each start on a
+    different column edge of their block; prose and irregular layouts lower it.
+    """
+    if not words:
+        return [], 0.0
+
+    height = statistics.median(w[3] - w[1] for w in words)
+    tables = []
+    clean_rows = 0
+    multi_cell_rows = 0
+    for block in _split_blocks(_group_rows(words, tolerance=0.4 * height), gap=2 * height):
+        table, clean, multi = _block_table([_split_cells(row, gap=0.8 * height) for row in block], tolerance=height / 2)
+        tables.append(table)
+        clean_rows += clean
+        multi_cell_rows += multi
+
+    if multi_cell_rows < TEXT_LAYER_MIN_ROWS:
+        return tables, 0.0
+    return tables, clean_rows / multi_cell_rows
+
+
+def read_text_layer(pdf_path: str) -> list:
+    """Runs the text-layer pass over every page, returning (page, tables, confidence, seconds) per page."""
+    pages = []
+    with pymupdf.open(pdf_path) as doc:
+        for number, page in enumerate(doc, start=1):
+            start = time.perf_counter()
+            words = [w[:5] for w in page.get_text("words") if w[4].strip()]
+            tables, confidence = rebuild_page_tables(words)
+            pages.append((str(number), tables, confidence, time.perf_counter() - start))
+    return pages
+
+
+## Fallback: Camelot's stream parser for pages the text layer could not structure
+def page_batches(pages: list, parts: int) -> list:
+    """Splits the page numbers into at most `parts` contiguous Camelot page lists, in order."""
+    parts = max(1, min(parts, len(pages)))
+    size, extra = divmod(len(pages), parts)
+    batches = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        batches.append(pages[start:end])
+        start = end
+    return batches
+
+
+def read_tables(pdf_path: str, pages: list) -> tuple:
+    """Runs Camelot over each page in turn, returning ((page, DataFrame) pairs, {page: seconds})."""
+    tables = []
+    timings = {}
+    for page in pages:
+        start = time.perf_counter()
+        tables.extend((str(table.page), table.df) for table in camelot.read_pdf(pdf_path, flavor='stream', pages=str(page)))
+        timings[str(page)] = time.perf_counter() - start
+    return tables, timings
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn avoids forking a process that already runs threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=EXTRACTION_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _merge_batches(results) -> tuple:
+    """Concatenates per-batch (tables, timings) results, in batch order."""
+    tables = []
+    timings = {}
+    for batch_tables, batch_timings in results:
+        tables.extend(batch_tables)
+        timings.update(batch_timings)
+    return tables, timings
+
+
+def read_tables_in_subprocesses(pdf_path: str, batches: list) -> tuple:
+    """Runs each page batch through this module in its own Python subprocess.
+
+    Celery's prefork children are daemonic and may not start a process pool,
+    but they can still run plain subprocesses. The subprocesses are killed if
+    this one is interrupted, e.g. by the task's soft time limit.
+    """
+    scratch = tempfile.mkdtemp(prefix="camelot-")
+    processes = []
+    try:
+        for i, batch in enumerate(batches):
+            output_path = os.path.join(scratch, f"{i}.pickle")
+            command = [sys.executable, os.path.abspath(__file__), pdf_path, output_path, *map(str, batch)]
+            processes.append((subprocess.Popen(command), output_path))
+
+        results = []
+        for process, output_path in processes:
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, process.args)
+            with open(output_path, "rb") as f:
+                results.append(pickle.load(f))
+        return _merge_batches(results)
+    finally:
+        for process, _ in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def read_camelot_tables(pdf_path: str, pages: list) -> tuple:
+    """Reads the given pages with Camelot, in page order, spreading long runs across processes.
+
+    Uses the shared process pool where this process may start one, and one
+    subprocess per batch where it may not (e.g. in a prefork child); parses
+    serially only if neither works.
+    """
+    if EXTRACTION_WORKERS <= 1 or len(pages) < PARALLEL_EXTRACTION_MIN_PAGES:
+        return read_tables(pdf_path, pages)
+    batches = page_batches(pages, EXTRACTION_WORKERS)
+
+    try:
+        if multiprocessing.current_process().daemon:
+            return read_tables_in_subprocesses(pdf_path, batches)
+        pool = _get_pool()
+        futures = [pool.submit(read_tables, pdf_path, batch) for batch in batches]
+    except (AssertionError, OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"Parallel extraction unavailable, parsing serially: {e}")
+        return read_tables(pdf_path, pages)
+
+    try:
+        return _merge_batches(future.result() for future in futures)
+    except BrokenProcessPool as e:
+        _reset_pool()
+        print(f"Extraction worker died, parsing serially: {e}")
+        return read_tables(pdf_path, pages)
+
+
+## Tiered extraction
+def read_report_tables(pdf_path: str) -> tuple:
+    """Reads every table in the report in page order, returning (tables, per-page timing records).
+
+    Each page is rebuilt from the text layer first; only pages whose row
+    structure is not confident enough are handed to Camelot.
+    """
+    tables = {}
+    timings = {}
+    hard_pages = []
+    for page, page_tables, confidence, seconds in read_text_layer(pdf_path):
+        timings[page] = {"page": page, "tier": "text", "confidence": round(confidence, 3), "seconds": seconds}
+        if confidence >= TEXT_LAYER_MIN_CONFIDENCE:
+            tables[page] = [(page, table) for table in page_tables]
+        else:
+            hard_pages.append(int(page))
+
+    if hard_pages:
+        camelot_tables, camelot_timings = read_camelot_tables(pdf_path, hard_pages)
+        for page, table in camelot_tables:
+            tables.setdefault(page, []).append((page, table))
+        for page, seconds in camelot_timings.items():
+            timings[page]["tier"] = "camelot"
+            timings[page]["seconds"] += seconds
+
+    ordered = sorted(tables, key=int)
+    return [table for page in ordered for table in tables[page]], [timings[page] for page in sorted(timings, key=int)]
+
+
+def normalise_cells(df):
+    """Stacks a Camelot table into a (row, column) Series of non-empty cells with tidy whitespace.
+
+    Line breaks inside a cell are kept, one per wrapped fragment, since the lab
+    result parser reads them as separate columns.
+    """
+    cells = df.stack().astype(str)
+    cells = (
+        cells.str.replace(r"[^\S\n]+", " ", regex=True)
+        .str.replace(r" ?\n[\s]*", "\n", regex=True)
+        .str.strip()
+    )
+    return cells[cells != ""]
+
+
+def extract_report_tables(pdf_path: str) -> dict:
+    """Extracts the report's tables and returns the cleaned table text for each page."""
+    # 1. Extract tables from the text layer, falling back to Camelot's stream method, in page order
+    tables, page_timings = read_report_tables(pdf_path)
+
+    # 2. Clean up each table into a text section and parse its lab result rows
+    sections = []
+    lab_results = []
+    for page, table_df in tables:
+        cells = normalise_cells(table_df)
+
+        # Everything from the "End of report" marker onwards, in this table and
+        # every later one, is footer text rather than results
+        marker = cells.str.contains(END_OF_REPORT_MARKER, regex=False)
+        end_of_report = marker.any()
+        if end_of_report:
+            end_row = marker.idxmax()[0]
+            cells = cells[cells.index.get_level_values(0) < end_row]
+
+        # Unstacking only the non-empty cells drops empty rows and columns
+        if not cells.empty:
+            df = cells.unstack(fill_value="").reset_index(drop=True)
+            # Wrapped cells such as "U4\n39854467" are read as one value in the text section
+            text = cells.str.replace("\n", " ", regex=False).unstack(fill_value="")
+            sections.append({"page": page, "text": text.to_string(index=False, header=True)})
+            lab_results.extend(parse_lab_results(df, page))
+
+        if end_of_report:
+            break
+
+    camelot_pages = sum(1 for timing in page_timings if timing["tier"] == "camelot")
+    print(
+        f"Extracted {len(page_timings)} pages ({len(page_timings) - camelot_pages} from the text layer, "
+        f"{camelot_pages} with Camelot) in {sum(timing['seconds'] for timing in page_timings):.2f}s"
+    )
+
+    return {
+        "table_count": len(tables),
+        "sections": sections,
+        "lab_results": deduplicate_lab_results(lab_results),
+        "pages": page_timings,
+    }
+
+
+if __name__ == "__main__":
+    # Entry point for read_tables_in_subprocesses: extraction.py PDF OUTPUT PAGE...
+    pdf_path, output_path, *page_args = sys.argv[1:]
+    with open(output_path, "wb") as f:
+        pickle.dump(read_tables(pdf_path, [int(page) for page in page_args]), f)
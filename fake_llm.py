@@ -0,0 +1,75 @@
+## Deterministic offline stand-in for the agents' LLM, for benchmarks and load tests
+import hashlib
+import json
+import os
+import re
+import time
+
+from crewai.llm import LLM
+
+from llm_cache import CachedLLM
+
+# Simulated provider latency per call
+FAKE_LLM_LATENCY_SECONDS = float(os.environ.get("FAKE_LLM_LATENCY_SECONDS", "0.5"))
+
+REPORT_TOOL_NAME = "Blood Test Report Searcher"
+PDF_PATH_PATTERN = re.compile(r"[\w./\\-]+\.pdf")
+# The same batch query the task descriptions ask the agents to use
+FAKE_SEARCH_QUERY = '"Hemoglobin" OR "Glucose" OR "Cholesterol" OR "TSH"'
+
+
+class FakeProvider(LLM):
+    """Answers every call without a network round trip, after a configurable delay.
+
+    On an agent's first step it calls the Blood Test Report Searcher on the
+    report named in the prompt, so extraction and retrieval run exactly as they
+    would for a real model; once an observation is in the history it returns a
+    final answer derived from a hash of the conversation.
+    """
+
+    def __init__(self, model: str = "fake/offline", latency_seconds: float = FAKE_LLM_LATENCY_SECONDS, **kwargs):
+        super().__init__(model=model, **kwargs)
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def supports_function_calling(self) -> bool:
+        # Keeps crewai on the text ReAct format this stand-in speaks
+        return False
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        return self._answer(messages)
+
+    def _answer(self, messages) -> str:
+        self.calls += 1
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        time.sleep(self.latency_seconds)
+
+        transcript = "\n".join(str(message.get("content", "")) for message in messages)
+        digest = hashlib.sha256(transcript.encode("utf-8")).hexdigest()[:12]
+        # crewai appends tool results to the agent's own (assistant) turns; the
+        # prompt's format instructions mention "Observation:" too, so skip those
+        steps = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "assistant")
+
+        pdf_path = PDF_PATH_PATTERN.search(transcript)
+        if REPORT_TOOL_NAME in transcript and pdf_path and "Observation:" not in steps:
+            action_input = json.dumps({"pdf_path": pdf_path.group(0), "search_query": FAKE_SEARCH_QUERY})
+            return (
+                "Thought: I should look up the key biomarkers in the report.\n"
+                f"Action: {REPORT_TOOL_NAME}\n"
+                f"Action Input: {action_input}"
+            )
+
+        observation = steps.rsplit("Observation:", 1)[-1].strip() if "Observation:" in steps else ""
+        return (
+            "Thought: I now know the final answer\n"
+            f"Final Answer: Offline answer {digest}.\n\n{observation[:500]}"
+        )
+
+
+class FakeLLM(CachedLLM, FakeProvider):
+    """FakeProvider behind the same response cache, coalescing and rate limiter as the real model.
+
+    The method order puts FakeProvider.call where litellm's provider call would
+    be, so benchmarks and load tests time the wrappers as production runs them.
+    """
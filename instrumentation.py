@@ -0,0 +1,146 @@
+## Per-job spans (durations, token counts, cache hits, peak RSS) and Prometheus-style metrics
+import contextvars
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this whole process so far, in megabytes.
+
+    It covers every job and thread the process has run, so a stage only
+    shows the high-water mark reached by the time it ended, not its own usage.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Span:
+    """One timed stage. Code inside the span may fill in tokens, cache_hit and extra attributes."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.tokens = None
+        self.cache_hit = None
+        self.started_at = datetime.utcnow()
+        self.duration_seconds = 0.0
+        self.peak_rss_mb = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_tokens(self, tokens: int):
+        self.tokens = (self.tokens or 0) + tokens
+
+
+class Trace:
+    """The spans recorded for one job in this process, from any thread working on it."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+@contextmanager
+def start_trace(source: str):
+    """Collects the spans recorded by this context, and by contexts copied from it, into a new Trace."""
+    trace = Trace(source)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times the block as a span of the current job. Outside a job the span is timed but not kept."""
+    current = Span(name, attributes)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration_seconds = time.perf_counter() - start
+        current.peak_rss_mb = peak_rss_mb()
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+
+def record_span(name: str, started_at: datetime, duration_seconds: float, tokens: int = None, **attributes):
+    """Adds a span measured elsewhere, e.g. between two callbacks, to the current job."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    recorded = Span(name, attributes)
+    recorded.started_at = started_at
+    recorded.duration_seconds = duration_seconds
+    recorded.tokens = tokens
+    recorded.peak_rss_mb = peak_rss_mb()
+    trace.add(recorded)
+
+
+def summarise_spans(spans: list) -> dict:
+    """Per-stage totals for a job's spans (dicts with the AnalysisSpan fields)."""
+    stages = {}
+    for s in spans:
+        stage = stages.setdefault(s["name"], {"name": s["name"], "count": 0, "total_seconds": 0.0, "tokens": 0, "cache_hits": 0, "cache_misses": 0})
+        stage["count"] += 1
+        stage["total_seconds"] += s["duration_seconds"] or 0.0
+        stage["tokens"] += s["tokens"] or 0
+        if s["cache_hit"] is not None:
+            stage["cache_hits" if s["cache_hit"] else "cache_misses"] += 1
+
+    return {
+        "stages": sorted(stages.values(), key=lambda stage: stage["total_seconds"], reverse=True),
+        "tokens": sum(s["tokens"] or 0 for s in spans),
+        "process_peak_rss_mb": max((s["peak_rss_mb"] for s in spans if s["peak_rss_mb"] is not None), default=None),
+    }
+
+
+## Prometheus text exposition
+class RequestMetrics:
+    """Request counts and latency totals per (method, route, status) for this API process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, str(status))
+        with self._lock:
+            count, total = self._series.get(key, (0, 0.0))
+            self._series[key] = (count + 1, total + seconds)
+
+    def samples(self) -> list:
+        with self._lock:
+            return sorted(self._series.items())
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_metric(name: str, metric_type: str, help_text: str, samples: list) -> str:
+    """Formats one metric family; samples are (suffix, labels dict, value) tuples."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    lines.extend(f"{name}{suffix}{_labels(**labels)} {value}" for suffix, labels, value in samples)
+    return "\n".join(lines)
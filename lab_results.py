@@ -0,0 +1,248 @@
+## Structured lab results parsed from the report tables, with a biomarker lookup index
+import re
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+VALUE_PATTERN = re.compile(r"^[<>]?=?\s*\d+(?:\.\d+)?$")
+RANGE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)$")
+BOUND_PATTERN = re.compile(r"^([<>]=?)\s*(\d+(?:\.\d+)?)$")
+
+# Common ways users and agents refer to biomarkers that the report names differently.
+# Keys and aliases are in normalised form (see normalise_name).
+BIOMARKER_SYNONYMS = {
+    "hemoglobin": ["haemoglobin", "hb", "hgb"],
+    "glucose": ["blood sugar", "fasting glucose", "glucose fasting", "fasting blood sugar"],
+    "hba1c": ["glycated hemoglobin", "glycosylated hemoglobin", "a1c"],
+    "total cholesterol": ["cholesterol total", "serum cholesterol"],
+    "ldl cholesterol": ["ldl", "ldl c", "bad cholesterol"],
+    "hdl cholesterol": ["hdl", "hdl c", "good cholesterol"],
+    "triglycerides": ["triglyceride", "tg"],
+    "vitamin b12": ["b12", "cyanocobalamin", "cobalamin"],
+    "vitamin d": ["25 hydroxy vitamin d", "25 oh vitamin d", "vitamin d total"],
+    "tsh": ["thyroid stimulating hormone"],
+    "complete blood count": ["cbc"],
+    "total leukocyte count": ["tlc", "wbc", "white blood cell count", "wbc count"],
+    "rbc count": ["red blood cell count", "red blood cells"],
+    "packed cell volume": ["pcv", "hematocrit", "haematocrit"],
+    "platelet count": ["platelets"],
+    "creatinine": ["serum creatinine"],
+    "iron": ["serum iron"],
+}
+
+
+class LabResult(BaseModel):
+    name: str
+    value: Optional[float] = None
+    value_text: str
+    units: str = ""
+    reference_interval: str = ""
+    ref_low: Optional[float] = None
+    ref_high: Optional[float] = None
+    flag: Optional[str] = None
+    panel: str = ""
+    page: str = ""
+
+
+def normalise_name(name: str) -> str:
+    """Lower-cases a test name and collapses punctuation so lookups are spelling-tolerant."""
+    name = name.lower().replace("haem", "hem")
+    name = re.sub(r"[^a-z0-9%]+", " ", name)
+    return " ".join(name.split())
+
+
+def _parse_interval(interval: str) -> Tuple[Optional[float], Optional[float]]:
+    match = RANGE_PATTERN.match(interval)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    match = BOUND_PATTERN.match(interval)
+    if match:
+        bound = float(match.group(2))
+        return (None, bound) if match.group(1).startswith("<") else (bound, None)
+    return None, None
+
+
+def _flag(value: Optional[float], low: Optional[float], high: Optional[float]) -> Optional[str]:
+    if value is None or (low is None and high is None):
+        return None
+    if low is not None and value < low:
+        return "LOW"
+    if high is not None and value > high:
+        return "HIGH"
+    return "NORMAL"
+
+
+def _row_tokens(row) -> List[str]:
+    # Camelot sometimes packs several columns into one cell separated by newlines
+    tokens = []
+    for cell in row:
+        for part in str(cell).split("\n"):
+            part = " ".join(part.split())
+            if part:
+                tokens.append(part)
+    return tokens
+
+
+def _is_panel_header(tokens: List[str]) -> bool:
+    if len(tokens) != 1:
+        return False
+    token = tokens[0]
+    # Parenthesised lines such as "(IFCC)" name the method of the test above, not a panel
+    if token.startswith("("):
+        return False
+    return any(c.isalpha() for c in token) and (token.isupper() or "profile" in token.lower())
+
+
+def parse_lab_results(df, page: str = "") -> List[dict]:
+    """Parses the Test Name / Results / Units / Bio. Ref. Interval rows of one extracted table."""
+    results = []
+    panel = ""
+    for row in df.itertuples(index=False):
+        tokens = _row_tokens(row)
+        if not tokens:
+            continue
+        if _is_panel_header(tokens):
+            panel = tokens[0]
+            continue
+
+        # A result row starts with the test name and is immediately followed by its value
+        name = tokens[0]
+        if len(tokens) < 2 or not VALUE_PATTERN.match(tokens[1]) or "|" in name or len(name) > 80:
+            continue
+        if not any(c.isalpha() for c in name):
+            continue
+
+        value_text = tokens[1]
+        units, interval = "", ""
+        for token in tokens[2:4]:
+            if RANGE_PATTERN.match(token) or BOUND_PATTERN.match(token):
+                interval = token
+                break
+            if not units:
+                units = token
+
+        low, high = _parse_interval(interval)
+        try:
+            value = float(value_text.lstrip("<>= "))
+        except ValueError:
+            value = None
+
+        results.append(LabResult(
+            name=name,
+            value=value,
+            value_text=value_text,
+            units=units,
+            reference_interval=interval,
+            ref_low=low,
+            ref_high=high,
+            flag=_flag(value, low, high),
+            panel=panel,
+            page=str(page),
+        ).model_dump())
+    return results
+
+
+def deduplicate_lab_results(records: List[dict]) -> List[dict]:
+    """Drops rows repeated across overlapping tables, keeping the first occurrence."""
+    seen = set()
+    unique = []
+    for record in records:
+        key = (normalise_name(record["name"]), record["value_text"], record["units"])
+        if key not in seen:
+            seen.add(key)
+            unique.append(record)
+    return unique
+
+
+class LabResultIndex:
+    """Name and synonym indexes over a report's lab results.
+
+    A query term matches a test name, panel or synonym exactly, or the start of
+    a name in whole words ("LDL Cholesterol" finds "LDL Cholesterol, Calculated").
+    A lone generic word such as "count" matches nothing and is left to the
+    vector search, so an OR-query costs O(terms) rather than an embedding call.
+    """
+
+    def __init__(self, records: List[dict]):
+        self.records = [LabResult(**record) for record in records]
+        self._names: Dict[str, List[int]] = {}
+        self._words: Dict[str, set] = {}
+
+        for i, record in enumerate(self.records):
+            for key in self._keys_for(record):
+                self._names.setdefault(key, []).append(i)
+                for word in key.split():
+                    self._words.setdefault(word, set()).add(i)
+
+        # Map every canonical name and synonym onto the records whose names contain all its words
+        for canonical, aliases in BIOMARKER_SYNONYMS.items():
+            matches = self._match_words(canonical)
+            for alias in [canonical] + aliases:
+                if alias not in self._names and matches:
+                    self._names[alias] = matches
+        self._sorted_names = sorted(self._names)
+
+    @staticmethod
+    def _keys_for(record: LabResult) -> List[str]:
+        keys = [normalise_name(record.name)]
+        # "VITAMIN B12; CYANOCOBALAMIN, SERUM" is also known by each ';' part,
+        # and "Total Leukocyte Count (TLC)" by its name and its abbreviation.
+        keys += [normalise_name(part) for part in record.name.split(";")[1:]]
+        keys += [normalise_name(part) for part in re.findall(r"\(([^)]+)\)", record.name)]
+        keys.append(normalise_name(re.sub(r"\([^)]*\)", "", record.name.split(";")[0])))
+        if record.panel:
+            keys += [normalise_name(part) for part in record.panel.split(";")]
+        return [key for key in dict.fromkeys(keys) if key]
+
+    def _match_words(self, term: str) -> List[int]:
+        words = term.split()
+        if not words or any(word not in self._words for word in words):
+            return []
+        matches = set.intersection(*(self._words[word] for word in words))
+        return sorted(matches)
+
+    def _match_prefix(self, key: str) -> List[int]:
+        matches = set()
+        start = bisect_left(self._sorted_names, key + " ")
+        for name in self._sorted_names[start:]:
+            if not name.startswith(key + " "):
+                break
+            matches.update(self._names[name])
+        return sorted(matches)
+
+    def lookup(self, term: str) -> List[LabResult]:
+        """Returns the results matching one biomarker name, synonym or panel."""
+        key = normalise_name(term)
+        if not key:
+            return []
+        indices = self._names.get(key) or self._match_prefix(key)
+        return [self.records[i] for i in indices]
+
+    def __len__(self):
+        return len(self.records)
+
+
+# Terms are separated by an upper-case OR, or by a comma between two quoted terms;
+# "iron or ferritin levels" and "glucose, fasting" stay single free-text terms.
+QUERY_TERM_SEPARATOR = re.compile(r"\s+OR\s+|(?<=[\"'`])\s*,\s*(?=[\"'`])")
+
+def split_query_terms(search_query: str) -> List[str]:
+    """Splits an agent query such as '"Glucose" OR "LDL Cholesterol"' into its terms."""
+    terms = QUERY_TERM_SEPARATOR.split(search_query)
+    terms = [term.strip().strip("'\"` ").strip() for term in terms]
+    return [term for term in terms if term]
+
+
+def format_lab_results(results: List[LabResult]) -> str:
+    """Renders lab results as compact rows for the LLM."""
+    lines = ["Test Name | Result | Units | Bio. Ref. Interval | Flag"]
+    for result in results:
+        lines.append(" | ".join([
+            result.name,
+            result.value_text,
+            result.units,
+            result.reference_interval,
+            result.flag or "",
+        ]))
+    return "\n".join(lines)
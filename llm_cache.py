@@ -0,0 +1,104 @@
+## Shared prompt -> completion cache with request coalescing for the agents' LLM
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cache import TieredCache
+from instrumentation import span
+from rate_limiter import RateLimitedLLM, check_cancelled
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join("data", "llm_cache"))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+# How long a coalesced call waits for the identical call ahead of it, which may itself
+# queue for up to LLM_RATE_LIMIT_MAX_WAIT_SECONDS before reaching the provider
+LLM_COALESCE_MAX_WAIT_SECONDS = float(os.environ.get("LLM_COALESCE_MAX_WAIT_SECONDS", "900"))
+# Waiting calls wake this often to see whether their job was cancelled
+COALESCE_POLL_SECONDS = 1.0
+
+# Every parameter that can change the completion for the same messages
+CACHE_KEY_PARAMS = (
+    "model", "temperature", "top_p", "n", "stop", "max_tokens", "max_completion_tokens",
+    "presence_penalty", "frequency_penalty", "seed", "response_format", "reasoning_effort",
+)
+
+llm_response_cache = TieredCache(
+    LLM_CACHE_DIR,
+    max_entries=256,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    max_disk_entries=LLM_CACHE_MAX_ENTRIES,
+)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class CachedLLM(RateLimitedLLM):
+    """An LLM whose plain completions are cached and whose identical concurrent calls are coalesced.
+
+    Calls that pass tools or functions are not cached, since their result is
+    tied to side effects rather than to the prompt alone. Only calls that
+    actually reach the provider go through the rate limiter.
+    """
+
+    def cache_key(self, messages) -> str:
+        params = {name: getattr(self, name, None) for name in CACHE_KEY_PARAMS}
+        payload = json.dumps({"params": params, "messages": messages}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        with span("llm.call", model=self.model) as timer:
+            return self._cached_call(timer, messages, tools, callbacks, available_functions, **kwargs)
+
+    def _cached_call(self, timer, messages, tools, callbacks, available_functions, **kwargs):
+        if not LLM_CACHE_ENABLED or tools or available_functions:
+            return super().call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions, **kwargs)
+
+        key = self.cache_key(messages)
+        cached = llm_response_cache.get(key)
+        timer.cache_hit = cached is not None
+        if cached is not None:
+            return cached["response"]
+
+        # Only the first caller for a key goes to the provider; the rest wait for its answer
+        with _in_flight_lock:
+            in_flight = _in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _in_flight[key] = _InFlightCall()
+
+        if not is_leader:
+            timer.set(coalesced=True)
+            deadline = time.monotonic() + LLM_COALESCE_MAX_WAIT_SECONDS
+            while not in_flight.done.wait(COALESCE_POLL_SECONDS):
+                check_cancelled()
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Timed out waiting for an identical LLM call in flight.")
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.response
+
+        try:
+            response = super().call(messages, callbacks=callbacks, **kwargs)
+            if isinstance(response, str) and response:
+                llm_response_cache.set(key, {"model": self.model, "response": response})
+            in_flight.response = response
+            return response
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with _in_flight_lock:
+                _in_flight.pop(key, None)
+            in_flight.done.set()
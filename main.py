@@ -1,18 +1,359 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request
+from typing import List
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import anyio
+import hashlib
+import json
 import os
+import time
 import uuid
-import shutil
+import zipfile
 
-from database import SessionLocal, AnalysisRequest, AnalysisResult, create_db_and_tables, get_db
-from worker import run_analysis_crew
+from cache import normalise_query
+from database import SessionLocal, AnalysisBatchReuse, AnalysisRequest, AnalysisResult, AnalysisSpan, AnalysisStageTotal, create_db_and_tables, get_db, save_trace
+from celery import chain, group
 from celery.result import AsyncResult
-from celery_config import celery_app
+from celery_config import ANALYSIS_TASK, INGESTION_TASK, celery_app, hard_time_limit
+from instrumentation import RequestMetrics, format_metric, span, start_trace, summarise_spans
+from progress import TERMINAL_STATUSES, subscribe_status
 
 # Create the database and tables on startup
 create_db_and_tables()
 
+UPLOAD_DIR = "data/uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_SIZE_MB", "20")) * 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+ZIP_MAGIC = b"PK\x03\x04"
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "50"))
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_SIZE_MB", "200")) * 1024 * 1024
+# Allowance for the multipart framing and the form's text fields on top of the files
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+class UploadSizeLimit:
+    """Caps the request body of the upload endpoints before the form is parsed.
+
+    Starlette spools the whole multipart body to a temporary file before a
+    handler runs, so the checks in save_upload only see an upload once all of
+    it has arrived. A request whose Content-Length is over its endpoint's limit
+    is refused without reading the body, and one sent without a length is cut
+    off with a 413 as soon as it passes the limit.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise RequestBodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app makes of the aborted form is replaced by the 413 below
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except RequestBodyTooLarge:
+            pass
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        await JSONResponse({"detail": "File too large."}, status_code=413)(scope, receive, send)
+
 app = FastAPI(title="Blood Test Report Analyser")
+app.add_middleware(UploadSizeLimit, limits={
+    "/analyze": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    "/analyze/batch": MAX_BATCH_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+})
+http_metrics = RequestMetrics()
+# Identical (document, query) submissions within this window reuse the earlier analysis; 0 disables reuse
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(24 * 3600)))
+# A pending or running request is only attached to if its status changed within this window;
+# by default the ingestion and analysis hard time limits, after which its worker has given up or died
+IN_FLIGHT_REUSE_SECONDS = int(os.environ.get(
+    "IN_FLIGHT_REUSE_SECONDS",
+    str(hard_time_limit(INGESTION_TASK) + hard_time_limit(ANALYSIS_TASK)),
+))
+
+def result_cache_key(document_hash: str, query: str) -> str:
+    return hashlib.sha256(f"{document_hash}\n{normalise_query(query)}".encode("utf-8")).hexdigest()
+
+async def save_upload(
+    file: UploadFile,
+    file_path: str,
+    magic: bytes = PDF_MAGIC,
+    kind: str = "PDF",
+    max_bytes: int = MAX_UPLOAD_BYTES,
+) -> tuple:
+    """
+    Copies an upload to disk in chunks, enforcing the per-file size cap and the
+    file signature. The request body as a whole is capped by UploadSizeLimit
+    before the form is parsed. Returns the size in bytes and the SHA-256 of the content.
+    """
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        async with await anyio.open_file(file_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(magic):
+                    raise HTTPException(status_code=400, detail=f"Invalid file content. Please upload a {kind}.")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="File too large.")
+                digest.update(chunk)
+                await buffer.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="The uploaded file is empty.")
+    except BaseException:
+        # Never leave a partial or rejected upload behind
+        await anyio.Path(file_path).unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+async def store_upload(file: UploadFile) -> tuple:
+    """Saves an upload under its content hash so repeated uploads share one file. Returns (path, hash)."""
+    await anyio.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    temp_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.part")
+    _, document_hash = await save_upload(file, temp_path)
+
+    file_path = os.path.join(UPLOAD_DIR, f"{document_hash}.pdf")
+    if await anyio.Path(file_path).exists():
+        await anyio.Path(temp_path).unlink(missing_ok=True)
+    else:
+        await anyio.Path(temp_path).rename(file_path)
+    return file_path, document_hash
+
+def store_report_bytes(data: bytes) -> tuple:
+    """Saves an in-memory PDF under its content hash. Returns (path, hash)."""
+    document_hash = hashlib.sha256(data).hexdigest()
+    file_path = os.path.join(UPLOAD_DIR, f"{document_hash}.pdf")
+    if not os.path.exists(file_path):
+        temp_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.part")
+        with open(temp_path, "wb") as buffer:
+            buffer.write(data)
+        os.replace(temp_path, file_path)
+    return file_path, document_hash
+
+def extract_zip_reports(zip_path: str) -> list:
+    """Stores every PDF inside a zip archive. Returns a (path, hash) pair per report."""
+    reports = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                if len(reports) >= MAX_BATCH_FILES:
+                    raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} reports per batch.")
+                # Read one byte past the cap rather than trusting the declared size
+                with archive.open(info) as member:
+                    data = member.read(MAX_UPLOAD_BYTES + 1)
+                if len(data) > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{info.filename} is too large.")
+                if not data.startswith(PDF_MAGIC):
+                    raise HTTPException(status_code=400, detail=f"{info.filename} is not a valid PDF.")
+                reports.append(store_report_bytes(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive.")
+    finally:
+        os.remove(zip_path)
+    return reports
+
+def find_reusable_request(db: Session, cache_key: str):
+    """
+    Returns the latest completed request for the same document and query within
+    the TTL, or one still in flight whose status changed within
+    IN_FLIGHT_REUSE_SECONDS, or None if there is none.
+    """
+    if RESULT_CACHE_TTL_SECONDS <= 0:
+        return None
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=RESULT_CACHE_TTL_SECONDS)
+    in_flight_cutoff = now - timedelta(seconds=IN_FLIGHT_REUSE_SECONDS)
+    # Rows created before updated_at existed fall back to created_at
+    last_update = func.coalesce(AnalysisRequest.updated_at, AnalysisRequest.created_at)
+    return (
+        db.query(AnalysisRequest)
+        .filter(
+            AnalysisRequest.cache_key == cache_key,
+            AnalysisRequest.celery_task_id.isnot(None),
+            AnalysisRequest.created_at >= cutoff,
+            or_(
+                AnalysisRequest.status == "COMPLETED",
+                and_(AnalysisRequest.status.in_(["PENDING", "PROCESSING"]), last_update >= in_flight_cutoff),
+            ),
+        )
+        .order_by(AnalysisRequest.created_at.desc())
+        .first()
+    )
+
+def find_reusable_response(db: Session, cache_key: str):
+    """Returns (request ID, response) for a reusable request (see find_reusable_request), or None."""
+    existing = find_reusable_request(db, cache_key)
+    if existing is None:
+        return None
+
+    response = {
+        "status": "success",
+        "message": "An identical analysis already exists; returning it.",
+        "task_id": existing.celery_task_id,
+        "cached": True,
+    }
+    if existing.status == "COMPLETED" and existing.result:
+        response["result"] = existing.result.report
+    return existing.id, response
+
+def create_analysis_request(db: Session, query: str, file_path: str, document_hash: str) -> AnalysisRequest:
+    """Creates a request record in the database."""
+    new_request = AnalysisRequest(
+        query=query,
+        file_path=file_path,
+        document_hash=document_hash,
+        cache_key=result_cache_key(document_hash, query),
+    )
+    db.add(new_request)
+    db.commit()
+    db.refresh(new_request)
+    return new_request
+
+def analysis_chain(request_id: str, task_id: str = None):
+    """Ingestion followed by the crew; task_id pins the crew task's ID in advance.
+
+    Tasks are referenced by name and sent with celery_app.send_task, so the API
+    never imports the worker and its crew, model and PDF dependencies.
+    """
+    crew_task = celery_app.signature(ANALYSIS_TASK, args=(request_id,), immutable=True)
+    if task_id is not None:
+        crew_task = crew_task.set(task_id=task_id)
+    return chain(celery_app.signature(INGESTION_TASK, args=(request_id,), immutable=True), crew_task)
+
+def dispatch_analysis(db: Session, analysis_request: AnalysisRequest) -> str:
+    """Dispatches ingestion followed by the crew, and saves the crew task's ID."""
+    task = analysis_chain(analysis_request.id).apply_async()
+    analysis_request.celery_task_id = task.id
+    db.commit()
+    return task.id
+
+def create_and_dispatch_batch(db: Session, query: str, reports: list) -> dict:
+    """
+    Reuses a finished or in-flight analysis for each report where there is one,
+    and inserts one request per remaining report in a single transaction, then
+    dispatches those as one Celery group. Task IDs are assigned up front so the
+    rows are complete before any worker can pick them up.
+    """
+    batch_id = str(uuid.uuid4())
+    requests = []
+    reused = []
+    seen_keys = set()
+    for file_path, document_hash in reports:
+        cache_key = result_cache_key(document_hash, query)
+        # The same report twice in one batch only needs analysing once
+        if cache_key in seen_keys:
+            continue
+        seen_keys.add(cache_key)
+        existing = find_reusable_request(db, cache_key)
+        if existing is not None:
+            reused.append(existing)
+            continue
+        requests.append(AnalysisRequest(
+            id=str(uuid.uuid4()),
+            celery_task_id=str(uuid.uuid4()),
+            batch_id=batch_id,
+            query=query,
+            file_path=file_path,
+            document_hash=document_hash,
+            cache_key=cache_key,
+        ))
+    db.add_all(requests)
+    # Reused requests belong to another batch or none, so record their membership separately
+    db.add_all(AnalysisBatchReuse(batch_id=batch_id, request_id=r.id) for r in reused)
+    db.commit()
+
+    if requests:
+        group(analysis_chain(r.id, r.celery_task_id) for r in requests).apply_async()
+    return {
+        "batch_id": batch_id,
+        "task_ids": [r.celery_task_id for r in requests],
+        "reused_task_ids": [r.celery_task_id for r in reused],
+    }
+
+def get_batch_progress(db: Session, batch_id: str):
+    """Aggregates the status of every request in a batch, reused ones included, or returns None if the batch is unknown."""
+    columns = (AnalysisRequest.celery_task_id, AnalysisRequest.status)
+    rows = db.query(*columns).filter(AnalysisRequest.batch_id == batch_id).all()
+    reused_rows = (
+        db.query(*columns)
+        .join(AnalysisBatchReuse, AnalysisBatchReuse.request_id == AnalysisRequest.id)
+        .filter(AnalysisBatchReuse.batch_id == batch_id)
+        .all()
+    )
+    if not rows and not reused_rows:
+        return None
+
+    tasks = [{"task_id": row.celery_task_id, "status": row.status} for row in rows]
+    tasks += [{"task_id": row.celery_task_id, "status": row.status, "cached": True} for row in reused_rows]
+    counts = {}
+    for task in tasks:
+        counts[task["status"]] = counts.get(task["status"], 0) + 1
+    finished = counts.get("COMPLETED", 0) + counts.get("FAILED", 0)
+    return {
+        "batch_id": batch_id,
+        "total": len(tasks),
+        "counts": counts,
+        "progress": finished / len(tasks),
+        "done": finished == len(tasks),
+        "tasks": tasks,
+    }
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts and times every request by route template; streams are timed up to their first byte."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_metrics.observe(
+            request.method,
+            route.path if route is not None else "unmatched",
+            status,
+            time.perf_counter() - start,
+        )
 
 @app.get("/")
 async def root():
@@ -32,37 +373,101 @@ async def analyze_blood_report(
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PDF.")
 
-    # Generate unique filename to avoid conflicts and save the file
-    upload_dir = "data/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(upload_dir, f"{file_id}_{file.filename}")
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    with start_trace("api") as trace:
+        # Stream the file to disk, stored under its content hash
+        with span("api.store_upload"):
+            file_path, document_hash = await store_upload(file)
+        query = query.strip()
 
-    # Create a request record in the database
-    new_request = AnalysisRequest(
-        query=query.strip(),
-        file_path=file_path
-    )
-    db.add(new_request)
-    db.commit()
-    db.refresh(new_request)
+        # Reuse a finished or in-flight analysis of the same report and query
+        with span("api.find_reusable") as timer:
+            reused = await run_in_threadpool(find_reusable_response, db, result_cache_key(document_hash, query))
+            timer.cache_hit = reused is not None
+        if reused is not None:
+            # The lookup's spans are stored against the reused request, apart from its own
+            request_id, response = reused
+            trace.source = "api.reuse"
+        else:
+            # The database and broker calls are blocking, so keep them off the event loop
+            with span("api.create_request"):
+                new_request = await run_in_threadpool(create_analysis_request, db, query, file_path, document_hash)
+            with span("api.dispatch"):
+                task_id = await run_in_threadpool(dispatch_analysis, db, new_request)
+            request_id = new_request.id
+            response = {
+                "status": "success",
+                "message": "Analysis task has been submitted.",
+                "task_id": task_id
+            }
+    await run_in_threadpool(save_trace, request_id, trace)
 
-    # Dispatch the background task and save its ID
-    task = run_analysis_crew.delay(new_request.id)
-    new_request.celery_task_id = task.id
-    db.commit()
+    return response
+
+@app.post("/analyze/batch")
+async def analyze_blood_reports_batch(
+    db: Session = Depends(get_db),
+    files: List[UploadFile] = File(...),
+    query: str = Form(default="Summarise my Blood Test Report")
+):
+    """
+    Accepts several PDF blood reports, or zip archives of them, with one query
+    for all of them, and dispatches every analysis in a single Celery group.
+    """
+    await anyio.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    reports = []
+    for file in files:
+        if file.filename.lower().endswith(".zip"):
+            zip_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.zip.part")
+            await save_upload(file, zip_path, magic=ZIP_MAGIC, kind="PDF or ZIP", max_bytes=MAX_BATCH_UPLOAD_BYTES)
+            reports.extend(await run_in_threadpool(extract_zip_reports, zip_path))
+        elif file.filename.endswith(".pdf"):
+            reports.append(await store_upload(file))
+        else:
+            raise HTTPException(status_code=400, detail=f"Invalid file type for {file.filename}. Please upload PDFs or a ZIP.")
+        if len(reports) > MAX_BATCH_FILES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} reports per batch.")
+
+    if not reports:
+        raise HTTPException(status_code=400, detail="No PDF reports found in the upload.")
+
+    batch = await run_in_threadpool(create_and_dispatch_batch, db, query.strip(), reports)
 
     return {
         "status": "success",
-        "message": "Analysis task has been submitted.",
-        "task_id": task.id
+        "message": (
+            f"{len(batch['task_ids'])} analysis tasks have been submitted; "
+            f"{len(batch['reused_task_ids'])} reused an existing analysis."
+        ),
+        **batch,
     }
 
+@app.get("/analyze/batch/{batch_id}")
+def get_batch_status(batch_id: str, db: Session = Depends(get_db)):
+    """
+    Returns aggregate progress for a batch, plus the status of each task in it.
+    """
+    progress = get_batch_progress(db, batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return progress
+
+@app.get("/results/{task_id}/status")
+def get_analysis_status(task_id: str, db: Session = Depends(get_db)):
+    """
+    Returns only the status of an analysis task. This reads a few columns
+    through the (celery_task_id, status) index and never touches the report body.
+    """
+    row = (
+        db.query(AnalysisRequest.celery_task_id, AnalysisRequest.status, AnalysisRequest.created_at)
+        .filter(AnalysisRequest.celery_task_id == task_id)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Task not found.")
+    return {"task_id": row.celery_task_id, "status": row.status, "created_at": row.created_at}
+
 @app.get("/results/{task_id}")
-async def get_analysis_result(task_id: str, db: Session = Depends(get_db)):
+def get_analysis_result(task_id: str, db: Session = Depends(get_db)):
     """
     Retrieves the status and result of an analysis task using the Celery Task ID.
     """
@@ -75,7 +480,8 @@ async def get_analysis_result(task_id: str, db: Session = Depends(get_db)):
     response = {"task_id": request.celery_task_id, "status": request.status, "created_at": request.created_at}
 
     if request.status == "COMPLETED" and request.result:
-        response["result"] = request.result.content
+        response["result"] = request.result.report
+        response["sections"] = request.result.sections
     elif request.status == "FAILED":
         # Get celery error info from Celery's backend
         task_result = AsyncResult(task_id, app=celery_app)
@@ -83,6 +489,133 @@ async def get_analysis_result(task_id: str, db: Session = Depends(get_db)):
 
     return response
 
+@app.get("/results/{task_id}/timings")
+def get_analysis_timings(task_id: str, db: Session = Depends(get_db)):
+    """
+    Returns where an analysis spent its time: every recorded span, plus per-stage
+    totals of duration, tokens and cache hits, and the highest peak RSS of the
+    processes that ran it. Spans of later submissions that reused this analysis
+    (source "api.reuse") are listed but not counted in its wall time.
+    """
+    request = (
+        db.query(AnalysisRequest.id, AnalysisRequest.status, AnalysisRequest.created_at)
+        .filter(AnalysisRequest.celery_task_id == task_id)
+        .first()
+    )
+    if not request:
+        raise HTTPException(status_code=404, detail="Task not found.")
+
+    spans = [
+        s.to_dict()
+        for s in db.query(AnalysisSpan).filter(AnalysisSpan.request_id == request.id).order_by(AnalysisSpan.started_at)
+    ]
+    finished_at = max(
+        (s["started_at"] + timedelta(seconds=s["duration_seconds"]) for s in spans if s["source"] != "api.reuse"),
+        default=None,
+    )
+    return {
+        "task_id": task_id,
+        "status": request.status,
+        "wall_seconds": (finished_at - request.created_at).total_seconds() if finished_at else None,
+        **summarise_spans(spans),
+        "spans": spans,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(db: Session = Depends(get_db)):
+    """
+    Prometheus text exposition: request counts and latencies of this API process,
+    plus per-stage totals of every span ever recorded, kept as running totals
+    so they outlive span retention.
+    """
+    http_samples = http_metrics.samples()
+    stages = (
+        db.query(
+            AnalysisStageTotal.name,
+            AnalysisStageTotal.span_count,
+            AnalysisStageTotal.duration_seconds,
+            AnalysisStageTotal.tokens,
+            AnalysisStageTotal.cache_hits,
+            AnalysisStageTotal.cache_lookups,
+            AnalysisStageTotal.peak_rss_mb,
+        )
+        .order_by(AnalysisStageTotal.name)
+        .all()
+    )
+    statuses = db.query(AnalysisRequest.status, func.count(AnalysisRequest.id)).group_by(AnalysisRequest.status).all()
+
+    families = [
+        format_metric("bloodtest_http_requests_total", "counter", "HTTP requests handled by this API process.", [
+            ("", {"method": method, "route": route, "status": status}, count)
+            for (method, route, status), (count, _) in http_samples
+        ]),
+        format_metric("bloodtest_http_request_duration_seconds", "summary", "Time to the response's first byte.", [
+            (suffix, {"method": method, "route": route, "status": status}, value)
+            for (method, route, status), (count, total) in http_samples
+            for suffix, value in (("_sum", total), ("_count", count))
+        ]),
+        format_metric("bloodtest_stage_duration_seconds", "summary", "Time spent in each analysis stage.", [
+            (suffix, {"stage": name}, value)
+            for name, count, total, *_ in stages
+            for suffix, value in (("_sum", total or 0.0), ("_count", count))
+        ]),
+        format_metric("bloodtest_stage_tokens_total", "counter", "Tokens used by each analysis stage.", [
+            ("", {"stage": name}, tokens or 0) for name, _, _, tokens, *_ in stages
+        ]),
+        format_metric("bloodtest_stage_cache_hits_total", "counter", "Cache hits of each cached analysis stage.", [
+            ("", {"stage": name}, hits) for name, _, _, _, hits, lookups, _ in stages if lookups
+        ]),
+        format_metric("bloodtest_stage_cache_lookups_total", "counter", "Cache lookups of each cached analysis stage.", [
+            ("", {"stage": name}, lookups) for name, _, _, _, _, lookups, _ in stages if lookups
+        ]),
+        format_metric("bloodtest_stage_process_peak_rss_megabytes", "gauge", "Highest peak RSS of the whole recording process (not the stage alone) at the end of each stage.", [
+            ("", {"stage": name}, rss) for name, *_, rss in stages if rss is not None
+        ]),
+        format_metric("bloodtest_analysis_requests", "gauge", "Analysis requests by status.", [
+            ("", {"status": status}, count) for status, count in statuses
+        ]),
+    ]
+    return "\n\n".join(families) + "\n"
+
+def get_status_event(task_id: str):
+    """Builds a status event from the database, or returns None if the task is unknown."""
+    db = SessionLocal()
+    try:
+        request = db.query(AnalysisRequest).filter(AnalysisRequest.celery_task_id == task_id).first()
+        if not request:
+            return None
+        event = {"task_id": task_id, "status": request.status}
+        if request.status == "COMPLETED" and request.result:
+            event["result"] = request.result.report
+        elif request.status == "FAILED":
+            event["error"] = str(AsyncResult(task_id, app=celery_app).result)
+        return event
+    finally:
+        db.close()
+
+@app.get("/results/{task_id}/stream")
+async def stream_analysis_result(task_id: str):
+    """
+    Streams status transitions for an analysis task as server-sent events:
+    PENDING, PROCESSING, one SECTION_COMPLETED per agent, then COMPLETED or FAILED.
+    """
+    event = await run_in_threadpool(get_status_event, task_id)
+    if event is None:
+        raise HTTPException(status_code=404, detail="Task not found.")
+
+    async def event_stream():
+        yield f"data: {json.dumps(event, default=str)}\n\n"
+        if event["status"] in TERMINAL_STATUSES:
+            return
+        async for update in subscribe_status(task_id):
+            if update is None:
+                # Comment line that keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(update)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
     # Note: `reload=True` is not recommended for production with Celery.
@@ -0,0 +1,224 @@
+## Lightweight per-report vector index: one memory-mapped NumPy matrix per report
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from lab_results import split_query_terms
+
+# "int8" stores each embedding as int8 with a per-row scale, a quarter of the float32 size
+NPY_INDEX_DTYPE = os.environ.get("NPY_INDEX_DTYPE", "float32")
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.json"
+# A scratch directory this old belongs to a build that died, not one in progress
+SCRATCH_MAX_AGE_SECONDS = 3600
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantise(vectors: np.ndarray) -> tuple:
+    """Symmetric per-row int8 quantisation, returning (int8 matrix, float32 scale per row)."""
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _write_scratch(directory: str, vectors: np.ndarray, texts: List[str], metadatas: List[dict], meta: dict, dtype: str) -> str:
+    """Writes a complete index next to `directory` under a scratch name, and returns that name."""
+    scratch = f"{directory}.{uuid.uuid4().hex}.part"
+    os.makedirs(scratch)
+    try:
+        if dtype == "int8":
+            vectors, scales = quantise(vectors)
+            np.save(os.path.join(scratch, SCALES_FILE), scales)
+        np.save(os.path.join(scratch, EMBEDDINGS_FILE), vectors)
+        with open(os.path.join(scratch, CHUNKS_FILE), "w", encoding="utf-8") as f:
+            json.dump({**meta, "texts": texts, "metadatas": metadatas, "dtype": dtype}, f)
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    return scratch
+
+
+class NumpyReportIndex(VectorStore):
+    """Exact cosine-similarity search over one report's chunk embeddings.
+
+    A report yields a few dozen chunks, so a brute-force matrix-vector product
+    over a memory-mapped `.npy` file beats a database collection, and the OS
+    page cache shares the matrix between worker processes. Queries made of
+    several ' OR '-separated terms are embedded in one batch and scored in one
+    matrix product, and the hits are interleaved so every term is represented.
+    """
+
+    def __init__(self, directory: str, embedding: Embeddings):
+        self.directory = directory
+        self._embedding = embedding
+        with open(os.path.join(directory, CHUNKS_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._matrix = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        scales_path = os.path.join(directory, SCALES_FILE)
+        self._scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @classmethod
+    def build(cls, directory: str, texts: List[str], embedding: Embeddings, metadatas: List[dict] = None, **meta) -> "NumpyReportIndex":
+        """Embeds the texts and writes the index to `directory`, which must not exist yet.
+
+        The files are written to a scratch directory that is renamed into place,
+        so a reader never sees a half-written index; if another process wins
+        the race, its index is used.
+        """
+        vectors = _normalise(np.asarray(embedding.embed_documents(texts), dtype=np.float32))
+        scratch = _write_scratch(directory, vectors, texts, metadatas or [{} for _ in texts], meta, NPY_INDEX_DTYPE)
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            if not os.path.exists(os.path.join(directory, CHUNKS_FILE)):
+                raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        return cls(directory, embedding)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: List[dict] = None, *, directory: str, **kwargs) -> "NumpyReportIndex":
+        return cls.build(directory, list(texts), embedding, metadatas, **kwargs)
+
+    def add_texts(self, texts, metadatas: List[dict] = None, **kwargs) -> List[str]:
+        """Embeds the texts and rewrites the index with them appended, returning their row numbers as IDs.
+
+        An index holds one report's few dozen chunks, so it is rewritten rather
+        than grown in place: the new files are written to a scratch directory
+        and swapped in, and readers that already mapped the old files keep them.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        existing = np.asarray(self._matrix, dtype=np.float32)
+        if self._scales is not None:
+            existing = existing * np.asarray(self._scales)[:, None]
+        added = _normalise(np.asarray(self._embedding.embed_documents(texts), dtype=np.float32))
+
+        first = len(self)
+        meta = {key: value for key, value in self.meta.items() if key not in ("texts", "metadatas", "dtype")}
+        scratch = _write_scratch(
+            self.directory,
+            np.concatenate([existing, added]),
+            self.meta["texts"] + texts,
+            self.meta["metadatas"] + list(metadatas or [{} for _ in texts]),
+            meta,
+            self.meta.get("dtype", "float32"),
+        )
+        retired = f"{self.directory}.{uuid.uuid4().hex}.part"
+        try:
+            os.rename(self.directory, retired)
+            os.rename(scratch, self.directory)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+            shutil.rmtree(retired, ignore_errors=True)
+
+        self.__init__(self.directory, self._embedding)
+        return [str(row) for row in range(first, len(self))]
+
+    def __len__(self) -> int:
+        return len(self.meta["texts"])
+
+    def touch(self, min_interval: float = 0):
+        """Marks the index as used now, for eviction by last use, unless it was marked within `min_interval` seconds.
+
+        Raises FileNotFoundError if the index has been deleted since it was opened.
+        """
+        if time.time() - last_used(self.directory) > min_interval:
+            os.utime(os.path.join(self.directory, CHUNKS_FILE))
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every chunk to every query, as a (chunks, queries) matrix."""
+        scores = np.asarray(self._matrix, dtype=np.float32) @ queries.T
+        if self._scales is not None:
+            scores *= np.asarray(self._scales)[:, None]
+        return scores
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[tuple]:
+        terms = split_query_terms(query) or [query]
+        queries = _normalise(np.asarray(self._embedding.embed_documents(terms), dtype=np.float32))
+        scores = self._scores(queries)
+
+        # Best chunk for each term first, then each term's second best, and so on
+        ranked = np.argsort(-scores, axis=0)
+        hits = {}
+        for rank in range(min(k, len(self))):
+            for term in range(len(terms)):
+                chunk = int(ranked[rank, term])
+                if chunk not in hits:
+                    hits[chunk] = float(scores[chunk, term])
+                if len(hits) == k:
+                    break
+            if len(hits) == k:
+                break
+
+        return [
+            (Document(page_content=self.meta["texts"][chunk], metadata=self.meta["metadatas"][chunk]), score)
+            for chunk, score in hits.items()
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+
+def last_used(directory: str) -> float:
+    try:
+        return os.path.getmtime(os.path.join(directory, CHUNKS_FILE))
+    except OSError:
+        return 0.0
+
+
+def is_current(directory: str, model: str) -> bool:
+    """Whether a complete index exists at `directory` and was embedded with `model`."""
+    try:
+        with open(os.path.join(directory, CHUNKS_FILE), encoding="utf-8") as f:
+            return json.load(f).get("model") == model
+    except (OSError, ValueError):
+        return False
+
+
+def stale_directories(root: str, ttl_seconds: float, max_reports: int) -> List[str]:
+    """Index directories past their TTL, then the least recently used ones beyond `max_reports`,
+    then scratch directories left behind by builds that died more than SCRATCH_MAX_AGE_SECONDS ago."""
+    if not os.path.isdir(root):
+        return []
+    now = time.time()
+    names = os.listdir(root)
+    entries = sorted(
+        (last_used(os.path.join(root, name)), os.path.join(root, name))
+        for name in names
+        if not name.endswith(".part")
+    )
+    expired = [entry for entry in entries if now - entry[0] > ttl_seconds]
+    remaining = entries[len(expired):]
+    overflow = remaining[:max(0, len(remaining) - max_reports)]
+
+    abandoned = []
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if name.endswith(".part") and now - os.path.getmtime(path) > SCRATCH_MAX_AGE_SECONDS:
+                abandoned.append(path)
+        except OSError:
+            pass
+    return [directory for _, directory in expired + overflow] + abandoned
@@ -0,0 +1,75 @@
+## Deterministic blood-report check that runs before any LLM call
+import re
+from typing import List
+
+from pydantic import BaseModel
+
+VALID_REPORT_MESSAGE = "The document appears to be a valid blood test report based on the presence of multiple key identifiers."
+INVALID_REPORT_MESSAGE = "The document does not appear to be a valid blood test report because it is missing key identifiers."
+
+# The verifier agent's negative verdict, in the wording of its expected output or close to it
+INVALID_VERDICT_PATTERN = re.compile(r"\b(?:does\s*not|doesn't)\s+appear\s+to\s+be\s+a\s+valid\b|\bis\s+not\s+a\s+valid\b", re.IGNORECASE)
+
+# The verifier agent looks for "Patient Name", "Lab Results", "Reference Range" and
+# "Hemoglobin". Lab reports word these differently, so each is a family of patterns.
+# Words that any document may contain, such as "name", "age" or "result", are not evidence.
+EVIDENCE_PATTERNS = {
+    "patient_details": re.compile(r"\bpatient\s*(?:name|id)\b|\b(?:age|sex)\s*/\s*(?:age|sex|gender)\b|\bgender\b|\bref(?:erred)?\.?\s*by\b", re.IGNORECASE),
+    "lab_results": re.compile(r"\btest\s*name\b|\blab(?:oratory)?\s*(?:no|report)\b|\bspecimen\b|\bsample\s*(?:type|id|collected|received)\b|\bcollected\s*(?:at|on)\b", re.IGNORECASE),
+    "reference_range": re.compile(r"\bref(?:erence)?\.?\s*(?:range|interval|value)s?\b|\bbio\.?\s*ref", re.IGNORECASE),
+    "biomarkers": re.compile(r"\bh(?:a)?emoglobin\b|\bglucose\b|\bcholesterol\b|\bcreatinine\b|\bplatelet|\bleu[ck]ocyte", re.IGNORECASE),
+}
+
+# Units a lab result is reported in, e.g. "g/dL", "thou/mm3", "mL/min/1.73m2", "%" or "fL".
+# Prices and quantities on invoices and price lists have none.
+LAB_UNIT_PATTERN = re.compile(r"^(?:%|fl|pg|ratio|[a-zµμ]+(?:/[a-z0-9µμ.^]+)+)$", re.IGNORECASE)
+
+# Accept outright only with the report-specific evidence and this many results in lab units;
+# reject outright with this little evidence and no results in lab units
+ACCEPT_REQUIRED_EVIDENCE = {"reference_range", "biomarkers"}
+ACCEPT_MIN_EVIDENCE = 3
+ACCEPT_MIN_LAB_RESULTS = 3
+REJECT_MAX_EVIDENCE = 1
+
+
+class ReportCheck(BaseModel):
+    decision: str  # "ACCEPT", "REJECT" or "AMBIGUOUS"
+    evidence: List[str]
+    lab_result_count: int
+    # Lab results whose units column holds a lab unit
+    unit_result_count: int = 0
+
+    @property
+    def message(self) -> str:
+        return VALID_REPORT_MESSAGE if self.decision == "ACCEPT" else INVALID_REPORT_MESSAGE
+
+
+def prevalidate_report(extraction: dict) -> ReportCheck:
+    """Classifies an extraction as a blood report or not, leaving borderline cases to the verifier agent."""
+    text = "\n".join(section["text"] for section in extraction.get("sections", []))
+    evidence = [name for name, pattern in EVIDENCE_PATTERNS.items() if pattern.search(text)]
+    lab_results = extraction.get("lab_results", [])
+    unit_result_count = sum(1 for result in lab_results if LAB_UNIT_PATTERN.match(result.get("units", "")))
+
+    if (
+        ACCEPT_REQUIRED_EVIDENCE.issubset(evidence)
+        and len(evidence) >= ACCEPT_MIN_EVIDENCE
+        and unit_result_count >= ACCEPT_MIN_LAB_RESULTS
+    ):
+        decision = "ACCEPT"
+    elif len(evidence) <= REJECT_MAX_EVIDENCE and unit_result_count == 0:
+        decision = "REJECT"
+    else:
+        decision = "AMBIGUOUS"
+
+    return ReportCheck(
+        decision=decision,
+        evidence=evidence,
+        lab_result_count=len(lab_results),
+        unit_result_count=unit_result_count,
+    )
+
+
+def verifier_rejected(verification_output: str) -> bool:
+    """Whether the verifier agent concluded that the document is not a blood report."""
+    return bool(INVALID_VERDICT_PATTERN.search(verification_output))
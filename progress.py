@@ -0,0 +1,62 @@
+## Job status events pushed from the worker to the API over Redis pub/sub
+import json
+
+import redis
+import redis.asyncio as aioredis
+
+from celery_config import REDIS_URL
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+# The last event is kept so clients that subscribe late still see the current state
+LAST_EVENT_TTL_SECONDS = 3600
+
+_redis = None
+
+
+def _channel(task_id: str) -> str:
+    return f"analysis:{task_id}"
+
+
+def publish_status(task_id: str, status: str, **data):
+    """Publishes a status event for a job. Failures are logged, never raised into the job."""
+    global _redis
+    event = json.dumps({"task_id": task_id, "status": status, **data})
+    try:
+        if _redis is None:
+            _redis = redis.Redis.from_url(REDIS_URL)
+        pipe = _redis.pipeline()
+        pipe.publish(_channel(task_id), event)
+        pipe.set(f"{_channel(task_id)}:last", event, ex=LAST_EVENT_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not publish status for {task_id}: {e}")
+
+
+async def subscribe_status(task_id: str, keepalive_seconds: float = 15.0):
+    """Yields status events for a job until it finishes, or None when no event arrives for a while."""
+    client = aioredis.Redis.from_url(REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(_channel(task_id))
+
+        # Subscribe before reading the last event so nothing falls in between
+        last_event = await client.get(f"{_channel(task_id)}:last")
+        if last_event is not None:
+            event = json.loads(last_event)
+            yield event
+            if event["status"] in TERMINAL_STATUSES:
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive_seconds)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        await pubsub.unsubscribe(_channel(task_id))
+        await pubsub.close()
+        await client.close()
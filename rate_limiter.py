@@ -0,0 +1,232 @@
+## Cross-process token-bucket scheduler for the LLM provider's RPM/TPM quota
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from crewai.llm import LLM
+
+from celery_config import REDIS_URL
+from context_builder import estimate_tokens as estimate_text_tokens
+from instrumentation import span
+
+LLM_RATE_LIMIT_ENABLED = os.environ.get("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Defaults match the Gemini free tier for gemini-2.0-flash-lite
+LLM_RPM_LIMIT = int(os.environ.get("LLM_RPM_LIMIT", "30"))
+LLM_TPM_LIMIT = int(os.environ.get("LLM_TPM_LIMIT", "1000000"))
+# Completion tokens reserved up front; the difference is settled once the response arrives
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.environ.get("LLM_COMPLETION_TOKEN_ESTIMATE", "1024"))
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "600"))
+
+KEY_PREFIX = "llm:rate"
+# A waiter that stops refreshing its heartbeat for this long loses its place in the queue
+WAITER_TTL_MS = 30000
+POLL_INTERVAL_SECONDS = 0.1
+
+# Grants a request only to the caller at the head of the FIFO queue, and only
+# if both buckets (requests and tokens) can cover it. Returns 0 when granted,
+# -1 when it is not the caller's turn yet, or the milliseconds until the
+# buckets will have refilled enough.
+ACQUIRE_SCRIPT = """
+local queue, rpm_key, tpm_key = KEYS[1], KEYS[2], KEYS[3]
+local ticket, now = ARGV[1], tonumber(ARGV[2])
+local rpm_cap, tpm_cap = tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens, waiter_prefix = tonumber(ARGV[5]), ARGV[6]
+
+while true do
+  local head = redis.call('ZRANGE', queue, 0, 0)[1]
+  if not head or head == ticket or redis.call('EXISTS', waiter_prefix .. head) == 1 then break end
+  redis.call('ZREM', queue, head)
+end
+if redis.call('ZRANGE', queue, 0, 0)[1] ~= ticket then return -1 end
+
+local function refill(key, cap)
+  local state = redis.call('HMGET', key, 'level', 'ts')
+  local level = tonumber(state[1]) or cap
+  local ts = tonumber(state[2]) or now
+  return math.min(cap, level + (now - ts) * cap / 60000)
+end
+
+local requests = refill(rpm_key, rpm_cap)
+local budget = refill(tpm_key, tpm_cap)
+local needed = math.min(tokens, tpm_cap)
+
+if requests >= 1 and budget >= needed then
+  redis.call('HSET', rpm_key, 'level', requests - 1, 'ts', now)
+  redis.call('HSET', tpm_key, 'level', budget - needed, 'ts', now)
+  redis.call('PEXPIRE', rpm_key, 120000)
+  redis.call('PEXPIRE', tpm_key, 120000)
+  redis.call('ZREM', queue, ticket)
+  return 0
+end
+
+local wait = 0
+if requests < 1 then wait = (1 - requests) * 60000 / rpm_cap end
+if budget < needed then wait = math.max(wait, (needed - budget) * 60000 / tpm_cap) end
+return math.max(1, math.ceil(wait))
+"""
+
+# Settles the token bucket once the real size of a completion is known
+SETTLE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'level', 'ts')
+if not state[1] then return 0 end
+redis.call('HSET', KEYS[1], 'level', tonumber(state[1]) - tonumber(ARGV[1]))
+return 0
+"""
+
+
+# Set by the job that owns this context once it has given up, e.g. after a failed
+# section or a soft time limit; LLM calls made from its threads then stop early
+_cancel_event = contextvars.ContextVar("llm_cancel_event", default=None)
+
+
+class JobCancelled(Exception):
+    """Raised instead of an LLM call whose job has already been abandoned."""
+
+
+@contextmanager
+def cancellable():
+    """Yields an Event that cancels the LLM calls of this context and of contexts copied from it."""
+    event = threading.Event()
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def check_cancelled():
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise JobCancelled("The job was cancelled before this LLM call.")
+
+
+def estimate_tokens(payload) -> int:
+    """Rough token count of a prompt or completion for quota accounting."""
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    return max(1, estimate_text_tokens(text))
+
+
+class LLMRateLimiter:
+    """Enforces requests-per-minute and tokens-per-minute budgets shared by every worker through Redis.
+
+    Callers are served first come, first served, so a job that issues many
+    calls cannot starve the others. If Redis is unreachable, calls go through
+    unthrottled rather than failing the job.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, rpm: int = LLM_RPM_LIMIT, tpm: int = LLM_TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._client = redis.Redis.from_url(redis_url)
+        self._acquire = self._client.register_script(ACQUIRE_SCRIPT)
+        self._settle = self._client.register_script(SETTLE_SCRIPT)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def acquire(self, tokens: int) -> float:
+        """Blocks until the call may be sent, returning the seconds spent waiting in the queue."""
+        start = time.monotonic()
+        try:
+            ticket = str(self._client.incr(f"{KEY_PREFIX}:ticket"))
+            waiter_key = f"{KEY_PREFIX}:waiter:{ticket}"
+            self._client.set(waiter_key, 1, px=WAITER_TTL_MS)
+            self._client.zadd(f"{KEY_PREFIX}:queue", {ticket: int(ticket)})
+            try:
+                while True:
+                    result = self._acquire(
+                        keys=[f"{KEY_PREFIX}:queue", f"{KEY_PREFIX}:rpm", f"{KEY_PREFIX}:tpm"],
+                        args=[ticket, int(time.time() * 1000), self.rpm, self.tpm, tokens, f"{KEY_PREFIX}:waiter:"],
+                    )
+                    if result == 0:
+                        break
+                    if time.monotonic() - start > LLM_RATE_LIMIT_MAX_WAIT_SECONDS:
+                        raise TimeoutError("Timed out waiting for LLM rate limit capacity.")
+                    delay = POLL_INTERVAL_SECONDS if result < 0 else result / 1000
+                    # Jitter keeps waiting workers from polling Redis in lockstep
+                    time.sleep(min(delay, 1.0) * random.uniform(0.8, 1.2))
+                    check_cancelled()
+                    self._client.pexpire(waiter_key, WAITER_TTL_MS)
+            finally:
+                self._client.zrem(f"{KEY_PREFIX}:queue", ticket)
+                self._client.delete(waiter_key)
+        except redis.RedisError as e:
+            print(f"LLM rate limiter unavailable, sending call unthrottled: {e}")
+
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+
+    def settle(self, reserved_tokens: int, used_tokens: int):
+        """Charges (or refunds) the difference between reserved and actual completion tokens."""
+        try:
+            self._settle(keys=[f"{KEY_PREFIX}:tpm"], args=[used_tokens - reserved_tokens])
+        except redis.RedisError:
+            pass
+
+    def _record_wait(self, waited: float):
+        with self._lock:
+            self.calls += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        try:
+            pipe = self._client.pipeline()
+            pipe.hincrby(f"{KEY_PREFIX}:metrics", "calls", 1)
+            pipe.hincrbyfloat(f"{KEY_PREFIX}:metrics", "wait_seconds", waited)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def stats(self) -> dict:
+        """Queue-wait metrics for this process."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "total_wait_seconds": self.total_wait_seconds,
+                "avg_wait_seconds": self.total_wait_seconds / self.calls if self.calls else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> LLMRateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = LLMRateLimiter()
+    return _limiter
+
+
+class RateLimitedLLM(LLM):
+    """An LLM that waits for quota from the shared rate limiter before every provider call.
+
+    Calls from a cancelled job (see cancellable) raise JobCancelled before
+    and after waiting instead of reaching the provider.
+    """
+
+    def call(self, messages, *args, **kwargs):
+        check_cancelled()
+        with span("llm.provider", model=self.model) as timer:
+            prompt_tokens = estimate_tokens(messages)
+            if not LLM_RATE_LIMIT_ENABLED:
+                response = super().call(messages, *args, **kwargs)
+            else:
+                limiter = get_rate_limiter()
+                completion_estimate = getattr(self, "max_tokens", None) or LLM_COMPLETION_TOKEN_ESTIMATE
+                timer.set(rate_limit_wait_seconds=limiter.acquire(prompt_tokens + completion_estimate))
+                check_cancelled()
+                response = super().call(messages, *args, **kwargs)
+                if isinstance(response, str):
+                    limiter.settle(completion_estimate, estimate_tokens(response))
+            timer.tokens = prompt_tokens + (estimate_tokens(response) if isinstance(response, str) else 0)
+        return response
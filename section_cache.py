@@ -0,0 +1,77 @@
+## Per-section output cache, so a follow-up query only re-runs the sections it changes
+import hashlib
+import json
+import os
+
+from cache import TieredCache, normalise_query
+
+SECTION_CACHE_ENABLED = os.environ.get("SECTION_CACHE_ENABLED", "true").lower() == "true"
+SECTION_CACHE_DIR = os.environ.get("SECTION_CACHE_DIR", os.path.join("data", "section_cache"))
+SECTION_CACHE_TTL_SECONDS = int(os.environ.get("SECTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SECTION_CACHE_MAX_ENTRIES = int(os.environ.get("SECTION_CACHE_MAX_ENTRIES", "5000"))
+
+section_cache = TieredCache(
+    SECTION_CACHE_DIR,
+    max_entries=256,
+    ttl_seconds=SECTION_CACHE_TTL_SECONDS,
+    max_disk_entries=SECTION_CACHE_MAX_ENTRIES,
+)
+
+
+def section_fingerprint(agent, task) -> str:
+    """Hashes everything besides the report and inputs that shapes a section's output.
+
+    That is the task's prompt, the agent's persona and tools, the LLM's
+    settings, and the formats of the report text the tools hand the agent,
+    so editing any of them invalidates the cached sections on its own. Call
+    it before kickoff, while the task's description is still the template.
+    """
+    from context_builder import CONTEXT_TOKEN_BUDGET
+    from llm_cache import CACHE_KEY_PARAMS
+    from tools import EXTRACTION_FORMAT_VERSION
+
+    payload = json.dumps({
+        "description": task.description,
+        "expected_output": task.expected_output,
+        "role": agent.role,
+        "goal": agent.goal,
+        "backstory": agent.backstory,
+        "max_iter": agent.max_iter,
+        "tools": sorted({tool.name for tool in (task.tools or []) + (agent.tools or [])}),
+        "llm": {name: getattr(agent.llm, name, None) for name in CACHE_KEY_PARAMS},
+        "extraction_format": EXTRACTION_FORMAT_VERSION,
+        "context_token_budget": CONTEXT_TOKEN_BUDGET,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def section_cache_key(section: str, fingerprint: str, document_hash: str, inputs: dict, input_names: list) -> str:
+    """Keys a section by the report, its task's fingerprint, and only the inputs the task reads.
+
+    `input_names` is the task's entry in task.SECTION_CACHE_INPUTS. The query
+    is normalised the same way as for whole-result reuse.
+    """
+    used_inputs = {
+        name: normalise_query(inputs[name]) if name == "query" else inputs[name]
+        for name in input_names
+    }
+    payload = json.dumps({
+        "section": section,
+        "fingerprint": fingerprint,
+        "document_hash": document_hash,
+        "inputs": used_inputs,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_section(cache_key: str):
+    """Returns a cached section output, or None."""
+    if not SECTION_CACHE_ENABLED:
+        return None
+    cached = section_cache.get(cache_key)
+    return cached["output"] if cached is not None else None
+
+
+def set_section(cache_key: str, section: str, output: str):
+    if SECTION_CACHE_ENABLED and output:
+        section_cache.set(cache_key, {"section": section, "output": output})
@@ -1,57 +1,89 @@
 ## Importing libraries and files
-from crewai import Task
+# Agents and tasks are built per job: crewai's kickoff rewrites each task's
+# description with the job's inputs and replaces each agent's executor, so
+# sharing them between concurrent jobs would mix up their prompts.
+from crewai import Agent, Task
 
-from agents import doctor, verifier, nutritionist, exercise_specialist
+from agents import create_doctor, create_verifier, create_nutritionist, create_exercise_specialist
 from tools import BloodTestReportTool
 
 ## Creating a task to help solve user's query
-help_patients = Task(
-    description="""Analyze the blood test report at {file_path} to answer the user's query: '{query}'.
+def create_help_patients(agent: Agent) -> Task:
+    return Task(
+        description="""Analyze the blood test report at {file_path} to answer the user's query: '{query}'.
 
 Your process must be efficient and targeted:
 1.  **Formulate a Batch Query**: Based on the user's query, identify all relevant medical terms and combine them into a single search query for the tool. Separate keywords with " OR " (e.g., `"Glucose" OR "LDL Cholesterol"`).
 2.  **Execute a Single, Powerful Search**: Use the 'Blood Test Report Searcher' tool **once** with your combined query.
 3.  **Synthesize and Explain**: Thoroughly analyze the retrieved text. Extract all relevant results, including value, units, and reference range. Explain the findings clearly and formulate a comprehensive answer to the user's query.
 4.  **Conclude**: Provide a final, easy-to-understand summary and advise the user to consult with a healthcare provider.""",
-    expected_output="""A detailed and well-structured answer that fully addresses the user's query, supported by specific data from the report. The output must include:
+        expected_output="""A detailed and well-structured answer that fully addresses the user's query, supported by specific data from the report. The output must include:
 - A list of all relevant lab results with their values, units, and reference ranges, derived from a single, efficient search.
 - A clear interpretation of each result.
 - A final summary that is easy for a layperson to understand.
 - A concluding statement advising consultation with a healthcare provider.""",
-    agent=doctor,
-)
+        agent=agent,
+    )
 
 ## Creating a nutrition analysis task
-nutrition_analysis = Task(
-    description="Your goal is to provide nutrition advice based on the user's query: '{query}' and the report at {file_path}. To do this efficiently, you must formulate a single, comprehensive search query that includes all major nutritional markers (e.g., 'Glucose', 'Cholesterol', 'HDL', 'LDL', 'Triglycerides', 'Iron', 'Vitamin D', 'Vitamin B12'). Execute one search with this batch query using the 'Blood Test Report Searcher' tool. Then, analyze the combined results to provide personalized and actionable nutritional recommendations.",
-    expected_output="""A detailed nutrition plan based on a thorough analysis of the report. It should include:
+def create_nutrition_analysis(agent: Agent) -> Task:
+    return Task(
+        description="Your goal is to provide nutrition advice based on the user's query: '{query}' and the report at {file_path}. To do this efficiently, you must formulate a single, comprehensive search query that includes all major nutritional markers (e.g., 'Glucose', 'Cholesterol', 'HDL', 'LDL', 'Triglycerides', 'Iron', 'Vitamin D', 'Vitamin B12'). Execute one search with this batch query using the 'Blood Test Report Searcher' tool. Then, analyze the combined results to provide personalized and actionable nutritional recommendations.",
+        expected_output="""A detailed nutrition plan based on a thorough analysis of the report. It should include:
 - A summary of all nutrition-related lab results found in the report from a single search.
 - An analysis of how these results relate to the user's nutritional status.
 - Specific, actionable dietary recommendations and a sample one-day meal plan.
 - A disclaimer that this is not medical advice and the user should consult a doctor.""",
-    agent=nutritionist,
-)
+        agent=agent,
+    )
 
 ## Creating an exercise planning task
-exercise_planning = Task(
-    description="Your goal is to create an exercise plan based on the user's query: '{query}' and the report at {file_path}. Formulate a single, comprehensive search query to find all lab results relevant to physical activity (e.g., 'Cholesterol', 'Hemoglobin', 'Cardiac Risk', 'CBC'). Use the 'Blood Test Report Searcher' tool just once with this query. Synthesize the findings from this single search to develop a safe, effective, and personalized exercise plan.",
-    expected_output="""A personalized exercise plan based on a comprehensive review of the report. It should include:
+def create_exercise_planning(agent: Agent) -> Task:
+    return Task(
+        description="Your goal is to create an exercise plan based on the user's query: '{query}' and the report at {file_path}. Formulate a single, comprehensive search query to find all lab results relevant to physical activity (e.g., 'Cholesterol', 'Hemoglobin', 'Cardiac Risk', 'CBC'). Use the 'Blood Test Report Searcher' tool just once with this query. Synthesize the findings from this single search to develop a safe, effective, and personalized exercise plan.",
+        expected_output="""A personalized exercise plan based on a comprehensive review of the report. It should include:
 - An assessment of the user's fitness level based on the relevant search results from a single search.
 - A recommended weekly exercise schedule, including types of exercise, duration, and intensity.
 - Safety precautions and modifications based on any potential health concerns identified in the report.
 - A disclaimer that the user should consult their doctor before starting an exercise program.""",
-    agent=exercise_specialist,
-)
-    
-verification = Task(
-    description="""Your mission is to validate the document at {file_path} as a legitimate blood test report in a single, efficient step.
+        agent=agent,
+    )
+
+## Creating a report verification task
+def create_verification(agent: Agent) -> Task:
+    return Task(
+        description="""Your mission is to validate the document at {file_path} as a legitimate blood test report in a single, efficient step.
 
 Follow this exact procedure:
 1.  **Execute a Single Batch Search**: Use the 'Blood Test Report Searcher' tool **once** with the following combined query: `"Patient Name" OR "Lab Results" OR "Reference Range" OR "Hemoglobin"`.
 2.  **Assess the Results**: Review the output from the tool. To be considered valid, the document must contain evidence for at least THREE of the four keywords.
 
 Your final answer must be a definitive statement of the document's validity based on this single search.""",
-    expected_output="A definitive statement based on a comprehensive search: 'The document appears to be a valid blood test report based on the presence of multiple key identifiers.' or 'The document does not appear to be a valid blood test report because it is missing key identifiers.'",
-    agent=verifier,
-    tools=[BloodTestReportTool()],
-)
\ No newline at end of file
+        expected_output="A definitive statement based on a comprehensive search: 'The document appears to be a valid blood test report based on the presence of multiple key identifiers.' or 'The document does not appear to be a valid blood test report because it is missing key identifiers.'",
+        agent=agent,
+        tools=[BloodTestReportTool()],
+    )
+
+## Section factories, keyed like worker.SECTION_TITLES
+SECTION_FACTORIES = {
+    "verification": (create_verifier, create_verification),
+    "medical": (create_doctor, create_help_patients),
+    "nutrition": (create_nutritionist, create_nutrition_analysis),
+    "exercise": (create_exercise_specialist, create_exercise_planning),
+}
+
+def create_section(key: str) -> tuple:
+    """Builds a fresh (agent, task) pair for one report section."""
+    create_agent, create_task = SECTION_FACTORIES[key]
+    agent = create_agent()
+    return agent, create_task(agent)
+
+## Task inputs each section's description reads besides the report itself, keyed like
+# worker.SECTION_TITLES. The section cache keys on these; changes to a task's prompt,
+# agent or LLM are picked up automatically (see section_cache.section_fingerprint).
+SECTION_CACHE_INPUTS = {
+    "verification": [],
+    "medical": ["query"],
+    "nutrition": ["query"],
+    "exercise": ["query"],
+}
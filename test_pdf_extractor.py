@@ -74,16 +74,18 @@ def test_extraction(pdf_path, output_path):
 
 if __name__ == "__main__":
     # --- Instructions ---
-    # 1. Place a PDF file you want to test inside the 'vwo-assignment/data/' directory.
+    # 1. Place a PDF file you want to test inside the 'data/' directory.
     # 2. Change the value of PDF_FILE_NAME to match the name of your file.
-    # 3. Run this script from your terminal: python vwo-assignment/test_pdf_extractor.py
+    # 3. Run this script from the project root: python test_pdf_extractor.py
+    # For timings rather than a manual look at the output, use benchmark.py.
     
     PDF_FILE_NAME = "sample.pdf"  # <-- CHANGE THIS to your test PDF file name
     
     # --- Do not change the code below ---
-    PDF_FILE_PATH = "/home/srinivasan/Downloads/VWO-Assignment/vwo-assignment/data/sample.pdf"
-    OUTPUT_FILE_PATH = "/home/srinivasan/Downloads/VWO-Assignment/vwo-assignment/outputs/extraction_output.txt"
-    CAMELOT_OUTPUT_PATH = "/home/srinivasan/Downloads/VWO-Assignment/vwo-assignment/outputs/camelot_tables.txt"
+    PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PDF_FILE_PATH = os.path.join(PROJECT_DIR, "data", PDF_FILE_NAME)
+    OUTPUT_FILE_PATH = os.path.join(PROJECT_DIR, "outputs", "extraction_output.txt")
+    CAMELOT_OUTPUT_PATH = os.path.join(PROJECT_DIR, "outputs", "camelot_tables.txt")
     
     # Run the existing text and pdfplumber extraction
     test_extraction(PDF_FILE_PATH, OUTPUT_FILE_PATH)
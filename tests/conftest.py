@@ -0,0 +1,18 @@
+## Test environment: offline LLM, no rate limiter, and every cache and database in a scratch directory
+import os
+import tempfile
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="bloodtest-tests-")
+
+os.environ.update(
+    FAKE_LLM="true",
+    FAKE_LLM_LATENCY_SECONDS="0",
+    LLM_RATE_LIMIT_ENABLED="false",
+    CREWAI_DISABLE_TELEMETRY="true",
+    OTEL_SDK_DISABLED="true",
+    DATABASE_URL=f"sqlite:///{os.path.join(SCRATCH_DIR, 'analysis_results.db')}",
+    EXTRACTION_CACHE_DIR=os.path.join(SCRATCH_DIR, "extraction_cache"),
+    VECTOR_INDEX_DIR=os.path.join(SCRATCH_DIR, "vector_index"),
+    LLM_CACHE_DIR=os.path.join(SCRATCH_DIR, "llm_cache"),
+    SECTION_CACHE_DIR=os.path.join(SCRATCH_DIR, "section_cache"),
+)
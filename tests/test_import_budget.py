@@ -0,0 +1,5 @@
+from check_import_budget import check_import_budget
+
+
+def test_api_import_stays_within_budget():
+    assert check_import_budget() == []
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import shutil
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from npy_index import NumpyReportIndex, stale_directories
+
+
+class WordHashEmbeddings(Embeddings):
+    """Bag-of-words vectors, so similar texts score higher without a model download."""
+
+    def embed_query(self, text):
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def index(tmp_path):
+    texts = ["Hemoglobin 13.1 g/dL", "Glucose Fasting 92 mg/dL", "Cholesterol Total 180 mg/dL"]
+    return NumpyReportIndex.build(str(tmp_path / "report"), texts, WordHashEmbeddings(), model="test")
+
+
+def test_add_texts_appends_and_persists(index):
+    ids = index.add_texts(["TSH 2.1 uIU/mL thyroid"], [{"page": "2"}])
+    assert ids == ["3"]
+    assert index.similarity_search("TSH thyroid", k=1)[0].page_content == "TSH 2.1 uIU/mL thyroid"
+
+    reopened = NumpyReportIndex(index.directory, WordHashEmbeddings())
+    assert len(reopened) == 4
+    assert reopened.meta["model"] == "test"
+    assert not [name for name in os.listdir(os.path.dirname(index.directory)) if name.endswith(".part")]
+
+
+def test_touch_reports_a_deleted_index(index):
+    shutil.rmtree(index.directory)
+    with pytest.raises(FileNotFoundError):
+        index.touch()
+
+
+def test_abandoned_scratch_directories_are_stale(index, tmp_path):
+    abandoned = tmp_path / "report.dead.part"
+    in_progress = tmp_path / "report.live.part"
+    abandoned.mkdir()
+    in_progress.mkdir()
+    os.utime(abandoned, (0, 0))
+
+    stale = stale_directories(str(tmp_path), ttl_seconds=3600, max_reports=10)
+    assert stale == [str(abandoned)]
@@ -0,0 +1,84 @@
+import pandas as pd
+
+from lab_results import parse_lab_results
+from prevalidation import INVALID_REPORT_MESSAGE, VALID_REPORT_MESSAGE, prevalidate_report, verifier_rejected
+
+
+def make_extraction(text: str, rows: list) -> dict:
+    """An extraction like tools.load_report_tables returns, from a page's header text and table rows."""
+    table_text = "\n".join("  ".join(row) for row in rows)
+    return {
+        "sections": [{"page": "1", "text": text + table_text}],
+        "lab_results": parse_lab_results(pd.DataFrame(rows), page="1"),
+    }
+
+
+BLOOD_REPORT = make_extraction(
+    "Patient Name: A. Sharma\nAge/Gender: 42 Y / Male\nSpecimen: Whole blood\n"
+    "Test Name  Results  Units  Bio. Ref. Interval\n",
+    [
+        ["Hemoglobin", "13.1", "g/dL", "13.0 - 17.0"],
+        ["Platelet Count", "210", "thou/mm3", "150 - 410"],
+        ["Glucose Fasting", "92", "mg/dL", "70 - 100"],
+        ["Creatinine", "0.9", "mg/dL", "0.7 - 1.3"],
+        ["HbA1c", "5.4", "%", "4.0 - 5.6"],
+    ],
+)
+
+# Generic words ("name", "age", "result") and numeric rows, but nothing only a lab report has
+INVOICE = make_extraction(
+    "Tax Invoice No. 2291\nName: A. Sharma\nAge: 42\nResult of your order\n",
+    [
+        ["Consultation fee", "1", "500.00"],
+        ["Paracetamol 500 mg strip", "2", "60.00"],
+        ["Home visit", "1", "250.00"],
+        ["Total", "810.00", ""],
+    ],
+)
+
+# Biomarker names, a "Test Name" header and numeric rows, but prices instead of results
+LAB_PRICE_LIST = make_extraction(
+    "Diagnostics price list 2024\nTest Name  Price (INR)  Results in\nName of patient and age required at booking\n",
+    [
+        ["Hemoglobin", "150", "INR", "24 hours"],
+        ["Glucose Fasting", "120", "INR", "24 hours"],
+        ["Lipid Profile (Cholesterol)", "650", "INR", "48 hours"],
+        ["Creatinine", "200", "INR", "24 hours"],
+    ],
+)
+
+
+def test_blood_report_is_accepted():
+    check = prevalidate_report(BLOOD_REPORT)
+    assert check.decision == "ACCEPT"
+    assert check.unit_result_count == 5
+
+
+def test_invoice_is_rejected():
+    check = prevalidate_report(INVOICE)
+    assert check.decision == "REJECT"
+    assert check.evidence == []
+    assert check.lab_result_count > 0
+
+
+def test_lab_price_list_is_left_to_the_verifier():
+    check = prevalidate_report(LAB_PRICE_LIST)
+    assert "biomarkers" in check.evidence
+    assert check.unit_result_count == 0
+    assert check.decision == "AMBIGUOUS"
+
+
+def test_report_without_lab_units_is_not_accepted():
+    rows = [[name, value, "", interval] for name, value, _, interval in [
+        ["Hemoglobin", "13.1", "", "13.0 - 17.0"],
+        ["Glucose Fasting", "92", "", "70 - 100"],
+        ["Creatinine", "0.9", "", "0.7 - 1.3"],
+    ]]
+    check = prevalidate_report(make_extraction("Patient Name: A. Sharma\nReference Range\n", rows))
+    assert check.decision == "AMBIGUOUS"
+
+
+def test_verifier_verdicts():
+    assert verifier_rejected(INVALID_REPORT_MESSAGE)
+    assert verifier_rejected("This file is not a valid blood test report.")
+    assert not verifier_rejected(VALID_REPORT_MESSAGE)
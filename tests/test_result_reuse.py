@@ -0,0 +1,95 @@
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from database import AnalysisBatchReuse, AnalysisRequest, AnalysisSpan, SessionLocal, create_db_and_tables
+
+
+@pytest.fixture
+def db():
+    create_db_and_tables()
+    session = SessionLocal()
+    yield session
+    session.query(AnalysisSpan).delete()
+    session.query(AnalysisBatchReuse).delete()
+    session.query(AnalysisRequest).delete()
+    session.commit()
+    session.close()
+
+
+def add_request(db, status: str, age: timedelta, idle: timedelta) -> AnalysisRequest:
+    """Adds a dispatched request created `age` ago whose status last changed `idle` ago."""
+    now = datetime.utcnow()
+    request = AnalysisRequest(
+        status=status,
+        cache_key="report-and-query",
+        celery_task_id=f"task-{status}-{age}",
+        created_at=now - age,
+        updated_at=now - idle,
+    )
+    db.add(request)
+    db.commit()
+    return request
+
+
+def test_running_request_is_attached_to(db):
+    request = add_request(db, "PROCESSING", age=timedelta(minutes=5), idle=timedelta(minutes=1))
+    request_id, response = main.find_reusable_response(db, "report-and-query")
+    assert request_id == request.id
+    assert response["task_id"] == request.celery_task_id
+
+
+def test_stalled_request_is_not_attached_to(db):
+    idle = timedelta(seconds=main.IN_FLIGHT_REUSE_SECONDS + 60)
+    add_request(db, "PROCESSING", age=idle, idle=idle)
+    add_request(db, "PENDING", age=idle, idle=idle)
+    assert main.find_reusable_response(db, "report-and-query") is None
+
+
+def test_completed_request_is_reused_for_the_whole_ttl(db):
+    request = add_request(db, "COMPLETED", age=timedelta(hours=20), idle=timedelta(hours=20))
+    request_id, response = main.find_reusable_response(db, "report-and-query")
+    assert request_id == request.id
+    assert response["task_id"] == request.celery_task_id
+
+
+def test_reused_submission_keeps_its_timings(db, monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    report = b"%PDF-1.4 reused report"
+    cache_key = main.result_cache_key(hashlib.sha256(report).hexdigest(), "Summarise my report")
+    request = add_request(db, "PROCESSING", age=timedelta(minutes=5), idle=timedelta(minutes=1))
+    request.cache_key = cache_key
+    db.commit()
+
+    response = TestClient(main.app).post(
+        "/analyze",
+        files={"file": ("report.pdf", report, "application/pdf")},
+        data={"query": "Summarise my report"},
+    )
+    assert response.json()["task_id"] == request.celery_task_id
+
+    spans = db.query(AnalysisSpan).filter(AnalysisSpan.request_id == request.id).all()
+    assert {s.name for s in spans} == {"api.store_upload", "api.find_reusable"}
+    assert {s.source for s in spans} == {"api.reuse"}
+
+
+def test_batch_dispatches_only_reports_without_a_reusable_analysis(db, monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(main, "group", lambda chains: type("Group", (), {"apply_async": lambda self: dispatched.extend(chains)})())
+    request = add_request(db, "COMPLETED", age=timedelta(hours=1), idle=timedelta(hours=1))
+    request.cache_key = main.result_cache_key("reused-hash", "Summarise")
+    db.commit()
+
+    batch = main.create_and_dispatch_batch(db, "Summarise", [("a.pdf", "reused-hash"), ("b.pdf", "new-hash")])
+    assert batch["reused_task_ids"] == [request.celery_task_id]
+    assert len(batch["task_ids"]) == 1
+    assert len(dispatched) == 1
+
+    progress = main.get_batch_progress(db, batch["batch_id"])
+    assert progress["total"] == 2
+    assert progress["counts"] == {"PENDING": 1, "COMPLETED": 1}
+    assert {t["task_id"] for t in progress["tasks"]} == {request.celery_task_id, *batch["task_ids"]}
@@ -0,0 +1,39 @@
+from section_cache import section_cache_key, section_fingerprint
+from task import SECTION_CACHE_INPUTS, create_section
+
+
+def test_fingerprint_is_stable_across_jobs():
+    assert section_fingerprint(*create_section("medical")) == section_fingerprint(*create_section("medical"))
+    assert section_fingerprint(*create_section("medical")) != section_fingerprint(*create_section("nutrition"))
+
+
+def test_fingerprint_follows_prompt_and_agent_changes():
+    agent, task = create_section("nutrition")
+    original = section_fingerprint(agent, task)
+
+    task.description += " Mention hydration."
+    assert section_fingerprint(agent, task) != original
+
+    agent, task = create_section("nutrition")
+    agent.backstory += " You trained in sports nutrition."
+    assert section_fingerprint(agent, task) != original
+
+
+def test_key_only_depends_on_the_inputs_a_task_reads():
+    agent, task = create_section("verification")
+    fingerprint = section_fingerprint(agent, task)
+    first = {"query": "Summarise my report", "file_path": "a.pdf"}
+    follow_up = {"query": "Is my cholesterol high?", "file_path": "a.pdf"}
+
+    verification_key = lambda inputs: section_cache_key("verification", fingerprint, "hash", inputs, SECTION_CACHE_INPUTS["verification"])
+    medical_key = lambda inputs: section_cache_key("medical", fingerprint, "hash", inputs, SECTION_CACHE_INPUTS["medical"])
+    assert verification_key(first) == verification_key(follow_up)
+    assert medical_key(first) != medical_key(follow_up)
+    assert medical_key(first) == medical_key({**first, "query": "summarise my report."})
+
+
+def test_specialists_read_the_users_question():
+    for key in ("medical", "nutrition", "exercise"):
+        _, task = create_section(key)
+        assert "{query}" in task.description
+        assert SECTION_CACHE_INPUTS[key] == ["query"]
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from database import AnalysisRequest, AnalysisSpan, AnalysisStageTotal, SessionLocal, create_db_and_tables, save_trace
+from instrumentation import Span, Trace
+
+
+@pytest.fixture
+def db():
+    create_db_and_tables()
+    session = SessionLocal()
+    yield session
+    session.query(AnalysisSpan).delete()
+    session.query(AnalysisStageTotal).delete()
+    session.query(AnalysisRequest).delete()
+    session.commit()
+    session.close()
+
+
+def make_trace(age: timedelta, cache_hit=None, peak_rss_mb=100.0) -> Trace:
+    trace = Trace("analysis")
+    span = Span("extraction", {})
+    span.started_at = datetime.utcnow() - age
+    span.duration_seconds = 2.0
+    span.tokens = 10
+    span.cache_hit = cache_hit
+    span.peak_rss_mb = peak_rss_mb
+    trace.add(span)
+    return trace
+
+
+def test_stage_totals_outlive_expired_spans(db, monkeypatch):
+    request = AnalysisRequest()
+    db.add(request)
+    db.commit()
+    monkeypatch.setattr(database, "_last_span_prune", 0.0)
+    monkeypatch.setattr(database, "SPAN_PRUNE_INTERVAL_SECONDS", 0)
+
+    save_trace(request.id, make_trace(timedelta(seconds=database.SPAN_RETENTION_SECONDS + 60), cache_hit=False))
+    save_trace(request.id, make_trace(timedelta(minutes=1), cache_hit=True, peak_rss_mb=150.0))
+
+    assert db.query(AnalysisSpan).count() == 1
+    total = db.query(AnalysisStageTotal).filter(AnalysisStageTotal.name == "extraction").one()
+    assert (total.span_count, total.duration_seconds, total.tokens) == (2, 4.0, 20)
+    assert (total.cache_hits, total.cache_lookups, total.peak_rss_mb) == (1, 2, 150.0)
@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+OVERSIZED = main.MAX_UPLOAD_BYTES + main.MULTIPART_OVERHEAD_BYTES + 1
+
+
+def test_oversized_content_length_is_refused_before_parsing(monkeypatch):
+    parsed = []
+    monkeypatch.setattr(main, "store_upload", lambda *args: parsed.append(args))
+
+    response = client.post(
+        "/analyze",
+        content=b"x" * 16,
+        headers={"content-type": "multipart/form-data; boundary=b", "content-length": str(OVERSIZED)},
+    )
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_oversized_body_without_length_is_cut_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    chunk = b"x" * (1024 * 1024)
+    sent = []
+
+    def body():
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="r.pdf"\r\nContent-Type: application/pdf\r\n\r\n%PDF-'
+        while sum(sent) <= OVERSIZED:
+            sent.append(len(chunk))
+            yield chunk
+
+    response = client.post("/analyze", content=body(), headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_small_non_pdf_is_rejected_by_signature():
+    response = client.post("/analyze", files={"file": ("r.pdf", b"not a pdf", "application/pdf")})
+    assert response.status_code == 400
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+import tools
+import worker
+from rate_limiter import JobCancelled, cancellable, check_cancelled
+
+
+@pytest.fixture
+def report_search(monkeypatch):
+    """Answers the report tool from memory, so the crew runs without extraction or embeddings."""
+    searches = []
+
+    def search(self, pdf_path, search_query, search_span):
+        searches.append(pdf_path)
+        return f"Hemoglobin 13.1 g/dL (13.0 - 17.0) from {pdf_path}"
+
+    monkeypatch.setattr(tools.BloodTestReportTool, "_search", search)
+    return searches
+
+
+def test_sequential_jobs_in_one_process(report_search):
+    """A second sequential job must not run into the first job's task callback."""
+    seen = []
+    for file_path in ["data/first.pdf", "data/second.pdf"]:
+        sections = worker.run_sequential_crew(
+            {"query": "Summarise my report", "file_path": file_path},
+            on_section=lambda key, output, file_path=file_path: seen.append((file_path, key)),
+        )
+        assert list(sections) == list(worker.SECTION_TITLES)
+        assert all(file_path in output for output in sections.values())
+
+    keys = list(worker.SECTION_TITLES)
+    assert seen == [("data/first.pdf", key) for key in keys] + [("data/second.pdf", key) for key in keys]
+
+
+def test_failed_specialist_cancels_the_others(monkeypatch):
+    """Once a parallel job has failed, its other specialists stop before their next LLM call."""
+    started = threading.Barrier(3)
+    failed = threading.Event()
+    outcomes = {}
+
+    def run_section_task(key, inputs, document_hash):
+        # Fail only once every specialist is running, so none is merely dequeued
+        started.wait()
+        if key == "medical":
+            failed.set()
+            raise RuntimeError("medical failed")
+        failed.wait()
+        # The next LLM call this specialist would make, once the job has given up
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            try:
+                check_cancelled()
+            except JobCancelled:
+                outcomes[key] = "cancelled"
+                return ""
+            time.sleep(0.01)
+        outcomes[key] = "called"
+        return ""
+
+    monkeypatch.setattr(worker, "run_section_task", run_section_task)
+    with pytest.raises(RuntimeError):
+        worker.run_parallel_crew({"query": "q", "file_path": "r.pdf"}, "hash", verification_output="ok")
+
+    deadline = time.monotonic() + 5
+    while len(outcomes) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert outcomes == {"nutrition": "cancelled", "exercise": "cancelled"}
+
+
+def test_invalid_verdict_skips_the_specialists(monkeypatch):
+    """An ambiguous document the verifier agent rejects never reaches the specialists."""
+    ran = []
+
+    def run_section_task(key, inputs, document_hash):
+        ran.append(key)
+        return "The document does not appear to be a valid blood test report because it is missing key identifiers."
+
+    monkeypatch.setattr(worker, "run_section_task", run_section_task)
+    sections = worker.run_parallel_crew({"query": "q", "file_path": "r.pdf"}, "hash")
+    assert ran == ["verification"]
+    assert list(sections) == ["verification"]
+
+
+def test_coalesced_llm_call_stops_waiting_when_cancelled(monkeypatch):
+    """A call waiting on an identical call in flight gives up once its job is cancelled."""
+    import llm_cache
+
+    monkeypatch.setattr(llm_cache, "COALESCE_POLL_SECONDS", 0.01)
+    llm = llm_cache.CachedLLM(model="gemini/gemini-2.0-flash-lite", api_key="test")
+    messages = [{"role": "user", "content": "Summarise the report"}]
+    # An identical call from another job that never finishes
+    monkeypatch.setitem(llm_cache._in_flight, llm.cache_key(messages), llm_cache._InFlightCall())
+
+    with cancellable() as cancelled:
+        threading.Timer(0.05, cancelled.set).start()
+        with pytest.raises(JobCancelled):
+            llm.call(messages)
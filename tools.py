@@ -2,108 +2,171 @@ from dotenv import load_dotenv
 load_dotenv()
 
 ## Importing libraries and files
+# Camelot/PyMuPDF (extraction), the vector store and torch (vector_index) and crewai_tools
+# are imported on first use, so importing this module stays cheap.
 import os
-import re
-import camelot
-import pandas as pd
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import threading
 from crewai.tools import BaseTool
-from crewai_tools import SerperDevTool
 from pydantic import BaseModel, Field
 from typing import Type
-from langchain_core.documents import Document
 
-from crewai_tools import tools
+from cache import LRUCache, TieredCache, sha256_file
+from context_builder import build_context, estimate_tokens
+from instrumentation import span
+from lab_results import LabResultIndex, format_lab_results, split_query_terms
 
 
 ## Creating search tool
-search_tool = SerperDevTool()
+_search_tool = None
+_search_tool_lock = threading.Lock()
+
+def get_search_tool():
+    """Returns the shared Serper web search tool, creating it on first use."""
+    global _search_tool
+    if _search_tool is None:
+        with _search_tool_lock:
+            if _search_tool is None:
+                from crewai_tools import SerperDevTool
+                _search_tool = SerperDevTool()
+    return _search_tool
+
+## Extraction cache for cleaned table text, keyed by the PDF's SHA-256.
+# Table extraction is by far the most expensive step, so every agent and every re-upload
+# of the same report shares one extraction.
+EXTRACTION_CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR", os.path.join("data", "extraction_cache"))
+EXTRACTION_CACHE_TTL_SECONDS = int(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", "1000"))
+extraction_cache = TieredCache(
+    EXTRACTION_CACHE_DIR,
+    max_entries=int(os.environ.get("EXTRACTION_CACHE_SIZE", "32")),
+    ttl_seconds=EXTRACTION_CACHE_TTL_SECONDS,
+    max_disk_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+)
+# Bump whenever the shape of the cached extraction changes so stale entries are ignored
+EXTRACTION_FORMAT_VERSION = 4
+lab_indexes = LRUCache(max_entries=int(os.environ.get("EXTRACTION_CACHE_SIZE", "32")))
+
+def load_report_tables(pdf_path: str) -> tuple:
+    """Returns (document hash, extraction) for a PDF, extracting tables only on a cache miss."""
+    with span("extraction") as timer:
+        doc_hash = sha256_file(pdf_path)
+        cache_key = f"{doc_hash}.v{EXTRACTION_FORMAT_VERSION}"
+        extraction = extraction_cache.get(cache_key)
+        timer.cache_hit = extraction is not None
+        if extraction is None:
+            from extraction import extract_report_tables
+            extraction = extract_report_tables(pdf_path)
+            extraction_cache.set(cache_key, extraction)
+            # Entries in an older format, or from before the format was versioned, are never read again
+            extraction_cache.disk.delete(doc_hash)
+            for version in range(EXTRACTION_FORMAT_VERSION):
+                extraction_cache.disk.delete(f"{doc_hash}.v{version}")
+        timer.set(pages=len(extraction.get("pages", [])), tables=extraction["table_count"])
+    return doc_hash, extraction
+
+def get_lab_index(doc_hash: str, extraction: dict) -> LabResultIndex:
+    """Returns the biomarker lookup index for a report's structured lab results."""
+    index = lab_indexes.get(doc_hash)
+    if index is None:
+        index = LabResultIndex(extraction.get("lab_results", []))
+        lab_indexes.set(doc_hash, index)
+    return index
+
+def build_report_text(extraction: dict) -> str:
+    """Combines the cleaned tables into a single string, with a page header on each for context."""
+    all_tables_text = [
+        f"--- Table from Page {section['page']} ---\n" + section["text"]
+        for section in extraction["sections"]
+    ]
+    return "\n\n".join(all_tables_text).strip()
+
+def ingest_report(pdf_path: str) -> str:
+    """Extracts, chunks and indexes a report ahead of the crew so its searches are cache hits."""
+    doc_hash, extraction = load_report_tables(pdf_path)
+    full_text = build_report_text(extraction)
+    if full_text:
+        from vector_index import get_report_index
+        get_report_index(doc_hash, full_text)
+    return doc_hash
 
 class BloodTestReportToolSchema(BaseModel):
     pdf_path: str = Field(description="The file path of the PDF blood test report.")
     search_query: str = Field(description="The specific query or question to search for within the report.")
 
+def build_search_context(search_span, parts: list, full_text: str = "") -> str:
+    """Builds the search tool's context and records the tokens it saved on the tool.search span."""
+    context = build_context(parts, full_text)
+    raw_tokens = sum(estimate_tokens(part) for part in parts)
+    search_span.set(raw_tokens=raw_tokens, tokens_saved=raw_tokens - estimate_tokens(context))
+    return context
+
 class BloodTestReportTool(BaseTool):
     name: str = "Blood Test Report Searcher"
-    description: str = "Searches for specific information within a PDF blood test report and returns only the most relevant snippets."
+    description: str = (
+        "Searches for specific information within a PDF blood test report and returns only the most relevant snippets. "
+        "Biomarker names separated by ' OR ' are looked up directly in the report's lab results."
+    )
     args_schema: Type[BaseModel] = BloodTestReportToolSchema
 
     def _run(self, pdf_path: str, search_query: str) -> str:
+        with span("tool.search", query_terms=len(split_query_terms(search_query))) as timer:
+            relevant_text = self._search(pdf_path, search_query, timer)
+            timer.tokens = estimate_tokens(relevant_text)
+        return relevant_text
+
+    def _search(self, pdf_path: str, search_query: str, search_span) -> str:
         # Sanitize the file path
         sanitized_path = pdf_path.strip("'\" ")
         
-        # 1. Extract tables using Camelot's stream method
+        # 1. Extract the report's tables, reusing earlier work on the same file
         try:
-            tables = camelot.read_pdf(sanitized_path, flavor='stream', pages='all')
+            doc_hash, extraction = load_report_tables(sanitized_path)
         except Exception as e:
-            return f"Error extracting tables with Camelot: {e}"
+            return f"Error extracting tables from the PDF: {e}"
 
-        if not tables:
+        if not extraction["table_count"]:
             return "No tables found in the PDF."
 
-        # 2. Process and consolidate all tables into a single string
-        all_tables_text = []
-        for i, table in enumerate(tables):
-            # Check each cell in the DataFrame for the "End of report" marker.
-            # This is more robust than checking the string representation.
-            end_of_report_found = False
-            for _, row in table.df.iterrows():
-                for cell in row:
-                    if "End of report" in str(cell):
-                        end_of_report_found = True
-                        break
-                if end_of_report_found:
-                    break
-            
-            # Skip the table if the marker was found
-            if end_of_report_found:
-                continue
-
-            # Clean up the DataFrame for better text representation
-            df = table.df.copy()
-            # The first row might not always be the header, so we'll treat it as data
-            # and let the LLM infer the structure from the clean text.
-            df.dropna(axis=1, how='all', inplace=True) # Drop empty columns
-            df.dropna(axis=0, how='all', inplace=True) # Drop empty rows
-            df.reset_index(drop=True, inplace=True)
-
-            # Prepend a header for the LLM to understand context
-            page_header = f"--- Table from Page {table.page} ---\n"
-            clean_table_text = df.to_string(index=False, header=True)
-            
-            all_tables_text.append(page_header + clean_table_text)
-
-        # 3. Combine all cleaned table text into a single string for the LLM
-        full_text = "\n\n".join(all_tables_text).strip()
+        # 2. Resolve biomarker terms directly against the structured lab results
+        with span("tool.lab_lookup") as timer:
+            lab_index = get_lab_index(doc_hash, extraction)
+            matched_results = []
+            unresolved_terms = []
+            for term in split_query_terms(search_query):
+                results = lab_index.lookup(term)
+                if results:
+                    matched_results.extend(r for r in results if r not in matched_results)
+                else:
+                    unresolved_terms.append(term)
+            timer.set(matched=len(matched_results), unresolved=len(unresolved_terms))
+
+        context_parts = []
+        if matched_results:
+            context_parts.append("--- Lab Results ---\n" + format_lab_results(matched_results))
+            if not unresolved_terms:
+                return build_search_context(search_span, context_parts)
+            search_query = " OR ".join(f'"{term}"' for term in unresolved_terms)
+
+        # 3. Fall back to semantic search for free-text questions and unmatched terms
+        full_text = build_report_text(extraction)
 
         if not full_text:
-             return "Could not extract any valid table content from the PDF."
+             return build_search_context(search_span, context_parts) or "Could not extract any valid table content from the PDF."
         
+        from vector_index import get_report_index
+        try:
+            vectorstore = get_report_index(doc_hash, full_text)
+            with span("tool.retrieve"):
+                retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
+                relevant_docs = retriever.get_relevant_documents(search_query)
+        except Exception as e:
+            # Keep whatever the lab result lookup found rather than failing the agent's step
+            return build_search_context(search_span, context_parts) or f"Error searching the report: {e}"
         
-        # 4. Split the text and create a searchable vector store
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        docs = text_splitter.create_documents([full_text])
-
-        # 5. Set up the vector store with embeddings
-        embeddings = HuggingFaceEmbeddings(model_kwargs={"device": "cpu"})
-        vectorstore = Chroma.from_documents(docs, embeddings)
-        
-        # 6. Search for the most relevant documents based on the query
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-        relevant_docs = retriever.get_relevant_documents(search_query)
-        
-        # 7. Concatenate the content of the relevant documents, ensuring uniqueness
-        unique_contents = []
-        seen_contents = set()
-        for doc in relevant_docs:
-            if doc.page_content not in seen_contents:
-                unique_contents.append(doc.page_content)
-                seen_contents.add(doc.page_content)
-        
-        relevant_text = "\n\n".join(unique_contents)
+        # 4. Merge overlapping chunks, compact table padding and trim to the token budget
+        with span("tool.build_context"):
+            context_parts.extend(doc.page_content for doc in relevant_docs)
+            relevant_text = build_search_context(search_span, context_parts, full_text)
 
         return relevant_text
 
@@ -0,0 +1,227 @@
+## Persistent per-report vector index shared across agents, jobs and workers
+import os
+import shutil
+import threading
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.vectorstores import VectorStore
+
+from cache import LRUCache
+from embeddings import EMBEDDING_MODEL, get_embeddings
+from instrumentation import span
+
+# "numpy" keeps each report's embeddings in a memory-mapped .npy matrix (npy_index.py);
+# "chroma" keeps one Chroma collection per report. Both are searched through as_retriever().
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "numpy")
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", os.path.join("data", "vector_index"))
+NPY_INDEX_DIR = os.path.join(VECTOR_INDEX_DIR, "npy")
+# Indexes that have not been searched for this long are deleted
+VECTOR_INDEX_TTL_SECONDS = int(os.environ.get("VECTOR_INDEX_TTL_SECONDS", str(7 * 24 * 3600)))
+# Upper bound on the number of report indexes kept on disk
+VECTOR_INDEX_MAX_REPORTS = int(os.environ.get("VECTOR_INDEX_MAX_REPORTS", "200"))
+# Upper bound on the number of report indexes held open in this process
+VECTOR_INDEX_CACHE_SIZE = int(os.environ.get("VECTOR_INDEX_CACHE_SIZE", "8"))
+# Chroma unloads least recently used collections from RAM past this limit
+VECTOR_INDEX_MEMORY_LIMIT_MB = int(os.environ.get("VECTOR_INDEX_MEMORY_LIMIT_MB", "512"))
+# last_used is only rewritten when it is older than this, to avoid a write per search
+TOUCH_INTERVAL_SECONDS = 300
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+_client = None
+_client_lock = threading.Lock()
+_open_indexes = LRUCache(max_entries=VECTOR_INDEX_CACHE_SIZE)
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import chromadb
+                from chromadb.config import Settings
+                os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+                _client = chromadb.PersistentClient(
+                    path=VECTOR_INDEX_DIR,
+                    settings=Settings(
+                        anonymized_telemetry=False,
+                        chroma_segment_cache_policy="LRU",
+                        chroma_memory_limit_bytes=VECTOR_INDEX_MEMORY_LIMIT_MB * 1024 * 1024,
+                    ),
+                )
+    return _client
+
+
+def _collection_name(doc_hash: str) -> str:
+    # Chroma collection names are limited to 63 characters
+    return f"report_{doc_hash[:56]}"
+
+
+def _build_lock(doc_hash: str) -> threading.Lock:
+    with _build_locks_lock:
+        return _build_locks.setdefault(doc_hash, threading.Lock())
+
+
+def split_report_text(full_text: str) -> list:
+    """Splits the report text into overlapping chunks for embedding."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return text_splitter.create_documents([full_text])
+
+
+def _touch(vectorstore: VectorStore) -> bool:
+    """Marks an open index as used, returning False if it has been deleted since it was opened."""
+    if VECTOR_STORE_BACKEND != "chroma":
+        try:
+            vectorstore.touch(min_interval=TOUCH_INTERVAL_SECONDS)
+        except FileNotFoundError:
+            return False
+        return True
+
+    # Look the collection up again rather than trusting the open handle: another
+    # worker's eviction may have deleted it, or deleted and rebuilt it under a new ID
+    collection = vectorstore._collection
+    try:
+        current = _get_client().get_collection(collection.name)
+        if current.id != collection.id:
+            return False
+        metadata = dict(current.metadata or {})
+        now = time.time()
+        if now - metadata.get("last_used", 0) > TOUCH_INTERVAL_SECONDS:
+            metadata["last_used"] = now
+            current.modify(metadata=metadata)
+    except _chroma_not_found_errors():
+        return False
+    return True
+
+
+def _chroma_not_found_errors() -> tuple:
+    """The exceptions chromadb raises for a missing collection; older versions raise ValueError."""
+    try:
+        from chromadb.errors import NotFoundError
+    except ImportError:
+        return (ValueError,)
+    return (ValueError, NotFoundError)
+
+
+def get_report_index(doc_hash: str, full_text: str) -> VectorStore:
+    """Returns the vector index for a report, embedding its chunks only the first time it is seen."""
+    with span("vector_index", backend=VECTOR_STORE_BACKEND) as timer:
+        vectorstore = _open_indexes.get(doc_hash)
+        if vectorstore is not None and _touch(vectorstore):
+            timer.cache_hit = True
+            return vectorstore
+        timer.cache_hit = False
+
+        # Not open yet, or evicted by another worker since this process opened it
+        with _build_lock(doc_hash):
+            if VECTOR_STORE_BACKEND == "chroma":
+                vectorstore = _open_chroma_index(doc_hash, full_text, timer)
+            else:
+                vectorstore = _open_npy_index(doc_hash, full_text, timer)
+            _open_indexes.set(doc_hash, vectorstore)
+            return vectorstore
+
+
+def _open_chroma_index(doc_hash: str, full_text: str, timer) -> VectorStore:
+    from langchain_community.vectorstores import Chroma
+
+    client = _get_client()
+    name = _collection_name(doc_hash)
+    vectorstore = Chroma(
+        client=client,
+        collection_name=name,
+        embedding_function=get_embeddings(),
+        collection_metadata={"doc_hash": doc_hash, "last_used": time.time()},
+    )
+
+    if vectorstore._collection.count() == 0:
+        # 1. Chunk and embed the report once
+        docs = split_report_text(full_text)
+        ids = [f"{name}-{i}" for i in range(len(docs))]
+        vectorstore.add_documents(docs, ids=ids)
+        timer.set(embedded_chunks=len(docs))
+        # 2. Keep the store bounded now that it has grown
+        evict_stale_indexes()
+    else:
+        # Persisted by an earlier job or another worker
+        timer.set(opened_from_disk=True)
+        _touch(vectorstore)
+    return vectorstore
+
+
+def _open_npy_index(doc_hash: str, full_text: str, timer) -> VectorStore:
+    from npy_index import NumpyReportIndex, is_current
+
+    directory = os.path.join(NPY_INDEX_DIR, doc_hash)
+    if is_current(directory, EMBEDDING_MODEL):
+        # Persisted by an earlier job or another worker
+        timer.set(opened_from_disk=True)
+        vectorstore = NumpyReportIndex(directory, get_embeddings())
+        _touch(vectorstore)
+        return vectorstore
+
+    # 1. Chunk and embed the report once, replacing any index built with another model
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(NPY_INDEX_DIR, exist_ok=True)
+    docs = split_report_text(full_text)
+    vectorstore = NumpyReportIndex.build(
+        directory,
+        [doc.page_content for doc in docs],
+        get_embeddings(),
+        [doc.metadata for doc in docs],
+        doc_hash=doc_hash,
+        model=EMBEDDING_MODEL,
+    )
+    timer.set(embedded_chunks=len(docs))
+    # 2. Keep the store bounded now that it has grown
+    evict_stale_indexes()
+    return vectorstore
+
+
+def evict_stale_indexes():
+    """Deletes indexes past their TTL, then the least recently used ones beyond the size limit.
+
+    Both stores are kept bounded whichever backend is selected, so indexes
+    written before VECTOR_STORE_BACKEND changed still expire.
+    """
+    _evict_npy_indexes()
+    if VECTOR_STORE_BACKEND == "chroma" or os.path.exists(os.path.join(VECTOR_INDEX_DIR, "chroma.sqlite3")):
+        _evict_chroma_indexes()
+
+
+def _evict_npy_indexes():
+    from npy_index import stale_directories
+    for directory in stale_directories(NPY_INDEX_DIR, VECTOR_INDEX_TTL_SECONDS, VECTOR_INDEX_MAX_REPORTS):
+        _open_indexes.pop(os.path.basename(directory))
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _evict_chroma_indexes():
+    client = _get_client()
+    now = time.time()
+    entries = []
+    for collection in client.list_collections():
+        # Newer chromadb versions return names rather than Collection objects
+        name = getattr(collection, "name", collection)
+        if not name.startswith("report_"):
+            continue
+        metadata = client.get_collection(name).metadata or {}
+        entries.append((metadata.get("last_used", 0), name, metadata.get("doc_hash")))
+
+    entries.sort()
+    expired = [entry for entry in entries if now - entry[0] > VECTOR_INDEX_TTL_SECONDS]
+    remaining = entries[len(expired):]
+    overflow = remaining[:max(0, len(remaining) - VECTOR_INDEX_MAX_REPORTS)]
+
+    for _, name, doc_hash in expired + overflow:
+        if doc_hash:
+            _open_indexes.pop(doc_hash)
+        try:
+            client.delete_collection(name)
+        except _chroma_not_found_errors():
+            # Another worker already removed it
+            pass
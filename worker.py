@@ -1,20 +1,229 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init
 from celery_config import celery_app
-from database import SessionLocal, AnalysisRequest, AnalysisResult
-from crewai import Crew, Process
-from agents import doctor, verifier, nutritionist, exercise_specialist
-from task import verification, help_patients, nutrition_analysis, exercise_planning
+from database import SessionLocal, AnalysisRequest, AnalysisResult, save_trace
+from instrumentation import record_span, span, start_trace
+from cache import sha256_file
+from section_cache import get_section, section_cache, section_cache_key, section_fingerprint, set_section
+from tools import extraction_cache, ingest_report, load_report_tables
+from prevalidation import prevalidate_report, verifier_rejected
+from progress import publish_status
+from rate_limiter import cancellable, get_rate_limiter
+import embeddings
 
-def get_crew(query: str, file_path: str):
-    """Initializes and returns the medical crew."""
+@worker_process_init.connect
+def warm_up_embeddings(**kwargs):
+    """Starts loading the embedding model once per worker process, before any task arrives.
+
+    The load runs on a background thread: Celery kills a child that has not
+    reported up within worker_proc_alive_timeout (4s by default), and a cold
+    torch import and model load take longer. A search that arrives first
+    waits for the same load under get_embeddings' lock.
+    """
+    threading.Thread(target=embeddings.warm_up, name="embedding-warm-up", daemon=True).start()
+
+# "parallel" verifies the report first and then runs the three specialists
+# concurrently, reusing cached sections; "sequential" runs the original
+# four-task crew in order, where each task also sees the earlier outputs,
+# so its sections are never cached.
+CREW_EXECUTION_MODE = os.environ.get("CREW_EXECUTION_MODE", "parallel")
+
+# Report sections, in the order they appear in the final report
+SECTION_TITLES = {
+    "verification": "Report Verification",
+    "medical": "Medical Analysis",
+    "nutrition": "Nutrition Plan",
+    "exercise": "Exercise Plan",
+}
+
+def get_crew(query: str, file_path: str, include_verification: bool = True, task_callback=None):
+    """Initializes and returns the medical crew, with agents and tasks built for this job alone."""
+    # crewai and the agents are imported on first use, so ingestion-only workers never build them
+    from crewai import Crew, Process
+    from task import create_section
+
+    keys = list(SECTION_TITLES) if include_verification else list(SECTION_TITLES)[1:]
+    sections = [create_section(key) for key in keys]
   
     return Crew(
-        agents=[verifier, doctor, nutritionist, exercise_specialist],
-        tasks=[verification, help_patients, nutrition_analysis, exercise_planning],
+        agents=[agent for agent, _ in sections],
+        tasks=[task for _, task in sections],
         process=Process.sequential,
+        task_callback=task_callback,
         verbose=True
     )
 
+def crew_tokens(output) -> int:
+    """Total tokens crewai counted for a kickoff, or None if it reported no usage."""
+    usage = getattr(output, "token_usage", None)
+    return getattr(usage, "total_tokens", None) or None
+
+def run_single_task(agent, task, inputs: dict, key: str) -> str:
+    """Runs one task in its own single-agent crew and returns its output."""
+    from crewai import Crew, Process
+    with span(f"task.{key}", agent=agent.role) as timer:
+        crew = Crew(agents=[agent], tasks=[task], process=Process.sequential, verbose=True)
+        output = crew.kickoff(inputs)
+        timer.tokens = crew_tokens(output)
+    return str(output)
+
+def run_section_task(key: str, inputs: dict, document_hash: str) -> str:
+    """Returns a section from the section cache, or builds its agent and task and runs it."""
+    from task import SECTION_CACHE_INPUTS, create_section
+    agent, task = create_section(key)
+    cache_key = section_cache_key(key, section_fingerprint(agent, task), document_hash, inputs, SECTION_CACHE_INPUTS[key])
+    with span("section_cache", section=key) as timer:
+        output = get_section(cache_key)
+        timer.cache_hit = output is not None
+    if output is None:
+        output = run_single_task(agent, task, inputs, key)
+        set_section(cache_key, key, output)
+    return output
+
+def run_parallel_crew(inputs: dict, document_hash: str, verification_output: str = None, on_section=None) -> dict:
+    """Verifies the report, then runs the specialist tasks concurrently since none depends on another.
+
+    Like a deterministic REJECT, a negative verdict from the verifier agent
+    ends the job with the verification section alone.
+
+    Each section is cached by report, task fingerprint and the inputs its task
+    reads, so a follow-up query on the same report only re-runs the sections
+    that depend on the query.
+    """
+    on_section = on_section or (lambda key, output: None)
+    if verification_output is None:
+        verification_output = run_section_task("verification", inputs, document_hash)
+        on_section("verification", verification_output)
+        if verifier_rejected(verification_output):
+            return {"verification": verification_output}
+    sections = {"verification": verification_output}
+
+    specialists = ["medical", "nutrition", "exercise"]
+    pool = ThreadPoolExecutor(max_workers=len(specialists))
+    with cancellable() as cancelled:
+        try:
+            # Each thread runs in a copy of this context so its spans land in the job's trace
+            # and its LLM calls see the cancellation below
+            futures = {
+                pool.submit(contextvars.copy_context().run, run_section_task, key, inputs, document_hash): key
+                for key in specialists
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                sections[key] = future.result()
+                on_section(key, sections[key])
+        finally:
+            # Don't block on the remaining specialists if one failed or the soft
+            # time limit fired, so the job can be marked FAILED right away. Threads
+            # already running can't be stopped, so their next LLM call raises
+            # JobCancelled instead of spending quota on an abandoned job.
+            cancelled.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return sections
+
+def run_sequential_crew(inputs: dict, verification_output: str = None, on_section=None) -> dict:
+    """Runs the full crew in order and returns each task's output as a report section."""
+    include_verification = verification_output is None
+    keys = list(SECTION_TITLES) if include_verification else list(SECTION_TITLES)[1:]
+
+    on_section = on_section or (lambda key, output: None)
+    # Tasks finish in crew order, so the n-th callback belongs to the n-th section,
+    # and the time since the previous callback is that task's duration
+    pending_keys = iter(keys)
+    task_started = [datetime.utcnow(), time.perf_counter()]
+
+    def task_callback(output):
+        key = next(pending_keys)
+        record_span(f"task.{key}", task_started[0], time.perf_counter() - task_started[1], agent=output.agent)
+        task_started[:] = [datetime.utcnow(), time.perf_counter()]
+        on_section(key, str(output))
+
+    crew = get_crew(
+        inputs["query"],
+        inputs["file_path"],
+        include_verification=include_verification,
+        task_callback=task_callback,
+    )
+    try:
+        with span("crew", mode="sequential") as timer:
+            result = crew.kickoff(inputs)
+            timer.tokens = crew_tokens(result)
+    finally:
+        # crewai copies the crew's task_callback onto every task without one;
+        # clear it so nothing that outlives this job still holds its closure
+        for task in crew.tasks:
+            task.callback = None
+
+    sections = {} if include_verification else {"verification": verification_output}
+    sections.update({key: str(output) for key, output in zip(keys, result.tasks_output)})
+    return sections
+
+def check_report(file_path: str):
+    """Runs the deterministic report check, or returns None if the report could not be extracted."""
+    try:
+        _, extraction = load_report_tables(file_path)
+    except Exception as e:
+        print(f"Report pre-check skipped: {e}")
+        return None
+    with span("prevalidation") as timer:
+        report_check = prevalidate_report(extraction)
+        timer.set(decision=report_check.decision)
+    return report_check
+
+def assemble_report(sections: dict) -> str:
+    """Merges the section outputs into the final markdown report."""
+    return "\n\n".join(
+        f"## {title}\n\n{sections[key]}"
+        for key, title in SECTION_TITLES.items()
+        if key in sections
+    )
+
+def traced(source: str):
+    """Records the wrapped task's spans under `source` and stores them against its request."""
+    def decorator(run):
+        @functools.wraps(run)
+        def wrapper(self, request_id: str):
+            with start_trace(source) as trace:
+                try:
+                    with span(source):
+                        return run(self, request_id)
+                finally:
+                    save_trace(request_id, trace)
+        return wrapper
+    return decorator
+
+@celery_app.task(bind=True)
+@traced("ingestion")
+def run_report_ingestion(self, request_id: str):
+    """Celery task that extracts and indexes the uploaded report before the crew starts."""
+    db = SessionLocal()
+    try:
+        request = db.query(AnalysisRequest).filter(AnalysisRequest.id == request_id).first()
+        if not request:
+            raise ValueError("Request not found")
+
+        doc_hash = ingest_report(request.file_path)
+        return {"status": "SUCCESS", "doc_hash": doc_hash}
+
+    except Exception as e:
+        # Ingestion is only a warm-up: the crew's tool falls back to extracting
+        # the report itself and reports the error to the agents if it fails again.
+        print(f"Report ingestion failed: {e}")
+        return {"status": "FAILED", "error": str(e)}
+
+    finally:
+        db.close()
+
 @celery_app.task(bind=True)
+@traced("analysis")
 def run_analysis_crew(self, request_id: str):
     """Celery task to run the full analysis crew."""
     db = SessionLocal()
@@ -27,28 +236,59 @@ def run_analysis_crew(self, request_id: str):
         # 2. Update status to PROCESSING
         request.status = "PROCESSING"
         db.commit()
+        publish_status(self.request.id, "PROCESSING")
 
-        # 3. Initialize and run the crew
-        medical_crew = get_crew(request.query, request.file_path)
+        def on_section(key: str, output: str):
+            publish_status(
+                self.request.id,
+                "SECTION_COMPLETED",
+                section=key,
+                title=SECTION_TITLES[key],
+                content=output,
+            )
+
+        # 3. Validate the report without the LLM where the answer is clear-cut;
+        #    the verifier agent only sees ambiguous documents
         inputs = {'query': request.query, 'file_path': request.file_path}
-        result = medical_crew.kickoff(inputs)
+        report_check = check_report(request.file_path)
+        verification_output = None
+        if report_check is not None and report_check.decision != "AMBIGUOUS":
+            verification_output = report_check.message
+            on_section("verification", verification_output)
+
+        # 4. Run the crew and merge its sections into the final report
+        if report_check is not None and report_check.decision == "REJECT":
+            sections = {"verification": verification_output}
+        elif CREW_EXECUTION_MODE == "sequential":
+            sections = run_sequential_crew(inputs, verification_output, on_section)
+        else:
+            document_hash = request.document_hash or sha256_file(request.file_path)
+            sections = run_parallel_crew(inputs, document_hash, verification_output, on_section)
+        result = assemble_report(sections)
+        print(f"Extraction cache stats: {extraction_cache.stats()}")
+        print(f"Section cache stats: {section_cache.stats()}")
+        print(f"LLM rate limiter stats: {get_rate_limiter().stats()}")
 
-        # 4. Save the result to the DB
-        new_result = AnalysisResult(request_id=request_id, content=str(result))
+        # 5. Save the result to the DB
+        new_result = AnalysisResult.from_report(request_id, result, sections)
         db.add(new_result)
         
-        # 5. Update status to COMPLETED
+        # 6. Update status to COMPLETED
         request.status = "COMPLETED"
         db.commit()
+        publish_status(self.request.id, "COMPLETED", result=str(result))
         
         return {"status": "SUCCESS", "result": str(result)}
 
     except Exception as e:
-        # Update status to FAILED
+        error = "Analysis exceeded its time limit." if isinstance(e, SoftTimeLimitExceeded) else str(e)
+        # Update status to FAILED, discarding anything half-written
+        db.rollback()
         request.status = "FAILED"
         db.commit()
+        publish_status(self.request.id, "FAILED", error=error)
         # Log the error, Celery will also store the exception
-        print(f"Task failed: {e}")
+        print(f"Task failed: {error}")
         # Reraise the exception to let Celery know the task failed
         raise
     